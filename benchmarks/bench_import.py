@@ -0,0 +1,177 @@
+'''
+Import-time benchmark of mummichog, to keep command line start-up fast.
+
+Each target runs in a fresh interpreter, repeated to take the median:
+    imports, timed by `python -X importtime -c "import <module>"`,
+        cumulative time of the module, heavy dependencies it pulled in,
+        and the slowest modules imported (self time);
+    commands, wall time of e.g. `python -m mummichog.main --version`,
+        i.e. interpreter start, imports and argument parsing, without loading models.
+
+numpy, scipy and networkx are imported on first use in mummichog,
+so the command line modules should not load them before arguments are parsed.
+
+Usage:
+    python benchmarks/bench_import.py -o import_times.json
+    python benchmarks/bench_import.py -o new.json --compare import_times.json --max_ratio 1.5
+With --max_ratio, the exit status is 1 if any target is slower than max_ratio times the earlier run,
+to be tracked in CI.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTS = ['mummichog', 'mummichog.parameters', 'mummichog.main', 'mummichog.command_line',
+           'mummichog.batch', 'mummichog.server', 'mummichog.api', 'mummichog.report.local_export']
+COMMANDS = {
+    'main --version': ['-m', 'mummichog.main', '--version'],
+    'main --help': ['-m', 'mummichog.main', '--help'],
+    'batch --help': ['-m', 'mummichog.batch', '--help'],
+    'serve --help': ['-m', 'mummichog.server', '--help'],
+    # all of the API, as loaded by an analysis run
+    'import api (all)': ['-c', 'from mummichog.api import *'],
+}
+HEAVY_MODULES = ['numpy', 'scipy', 'scipy.stats', 'networkx', 'matplotlib']
+
+
+def run_python(args, importtime=False):
+    '''
+    Run a fresh interpreter in REPO_DIR. Return (wall time in seconds, stdout, stderr).
+    '''
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + args
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError("%s failed:\n%s" %(' '.join(cmd), proc.stderr))
+    return wall, proc.stdout, proc.stderr
+
+
+def parse_importtime(text):
+    '''
+    Parse -X importtime output, lines of
+        import time: self [us] | cumulative | imported package
+    Return:
+        {module: (self seconds, cumulative seconds)}, first import of each module
+    '''
+    times = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue            # header line
+        times.setdefault(fields[2].strip(), (self_us * 1e-6, cumulative_us * 1e-6))
+    return times
+
+
+def bench_import(module, repeat, top=10):
+    '''
+    Median cumulative import time of module, with heavy modules loaded and the slowest imports.
+    '''
+    code = "import %s, sys; print(' '.join(sorted(sys.modules)))" %module
+    cumulative, runs = [], []
+    for ii in range(repeat):
+        wall, out, err = run_python(['-c', code], importtime=True)
+        times = parse_importtime(err)
+        cumulative.append(times[module][1])
+        runs.append((times, out.split()))
+    times, loaded = runs[cumulative.index(statistics.median_low(cumulative))]
+    slowest = sorted(times.items(), key=lambda x: -x[1][0])[:top]
+    return {'target': 'import ' + module, 'time': statistics.median(cumulative),
+            'min_time': min(cumulative), 'num_modules': len(times),
+            'heavy_modules': [m for m in HEAVY_MODULES if m in loaded],
+            'slowest': [{'module': m, 'self_time': s, 'cumulative_time': c} for m, (s, c) in slowest]}
+
+
+def bench_command(name, args, repeat):
+    '''
+    Median wall time of a command in a fresh interpreter, from process start to exit.
+    '''
+    walls = [run_python(args)[0] for ii in range(repeat)]
+    return {'target': name, 'time': statistics.median(walls), 'min_time': min(walls)}
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(['git', '-C', REPO_DIR, 'rev-parse', 'HEAD'],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    # start-up time of the interpreter itself, as baseline of the commands
+    baseline = statistics.median([run_python(['-c', 'pass'])[0] for ii in range(5)])
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'cpu_count': os.cpu_count(), 'interpreter_start': baseline}
+
+
+def compare_results(new, old, max_ratio=None):
+    '''
+    Print median time of each target, old vs new.
+    Return targets slower than max_ratio times old.
+    '''
+    old_times = {r['target']: r['time'] for r in old['results']}
+    slower = []
+    print("\n%-28s %10s %10s %8s" %('target', 'old (ms)', 'new (ms)', 'ratio'))
+    for r in new['results']:
+        t0 = old_times.get(r['target'])
+        if t0 is None:
+            continue
+        ratio = r['time'] / t0 if t0 else float('nan')
+        print("%-28s %10.1f %10.1f %8.2f" %(r['target'], t0 * 1000, r['time'] * 1000, ratio))
+        if max_ratio is not None and ratio > max_ratio:
+            slower.append(r['target'])
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mummichog import-time benchmark')
+    parser.add_argument('--imports', nargs='+', default=IMPORTS,
+                        help='modules to time by -X importtime')
+    parser.add_argument('--commands', nargs='*', choices=list(COMMANDS), default=list(COMMANDS),
+                        help='commands to time')
+    parser.add_argument('-r', '--repeat', type=int, default=7,
+                        help='runs per target, median is reported')
+    parser.add_argument('-o', '--output', type=str, default='import_times.json',
+                        help='JSON file of results')
+    parser.add_argument('--compare', type=str, help='results JSON of an earlier run to compare to')
+    parser.add_argument('--max_ratio', type=float,
+                        help='with --compare, exit with status 1 if a target is slower by more than this ratio')
+    args = parser.parse_args()
+
+    results = {'environment': get_environment(), 'repeat': args.repeat, 'results': []}
+    for module in args.imports:
+        r = bench_import(module, args.repeat)
+        print("    %-28s %8.1f ms  %4d modules  heavy: %s" %(r['target'], r['time'] * 1000,
+                r['num_modules'], ', '.join(r['heavy_modules']) or '-'))
+        results['results'].append(r)
+    for name in args.commands:
+        r = bench_command(name, COMMANDS[name], args.repeat)
+        print("    %-28s %8.1f ms" %(r['target'], r['time'] * 1000))
+        results['results'].append(r)
+
+    with open(args.output, 'w') as O:
+        json.dump(results, O, indent=2)
+    print("Benchmark results were written in %s." %args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare_results(results, json.load(f), args.max_ratio)
+        if slower:
+            print("Slower than %.2f x: %s" %(args.max_ratio, ', '.join(slower)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+'''
+End-to-end benchmark of mummichog, stage by stage as in main():
+    InputUserData.read, get_metabolic_model, DataMeetModel, PathwayAnalysis.cpd_enrich_test,
+    ModularAnalysis.dispatch, ActivityNetwork and json_export, with their nested stages.
+
+Stages are recorded by the same instrumentation as --trace (see mummichog/stageTrace.py):
+wall time, CPU time, resident memory (RSS) before/after, peak RSS and item counts;
+with --tracemalloc, also the peak of Python allocations within the stage
+(tracing slows down the stages, so timings are not comparable to runs without it).
+
+Datasets:
+    ineurons        tests/ineurons_ttest_1127.tsv with tests/empCpds_with_annotations.json.zip
+    testdata0710    tests/testdata0710.txt, no annotation
+    synthetic50k, synthetic200k
+                    features resampled from ineurons m/z and rtime, with singleton annotation
+
+Usage:
+    python benchmarks/bench_pipeline.py -o bench_results.json
+    python benchmarks/bench_pipeline.py --datasets ineurons synthetic50k -p 100 -o new.json --compare old.json
+'''
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+TEST_DIR = os.path.join(REPO_DIR, 'tests')
+
+from mummichog.parameters import PARAMETERS
+from mummichog.stageTrace import StageTrace, active_trace, stage
+from mummichog.main import run_analyses
+from mummichog.report.reporting import json_export_sections, write_json_sections
+from mummichog.models.get_models import get_metabolic_model
+from mummichog.annotate.featureTable import make_feature_id
+from mummichog.api import *
+
+DATASETS = {
+    'ineurons': {'infile': 'ineurons_ttest_1127.tsv', 'annotation': 'empCpds_with_annotations.json.zip'},
+    'testdata0710': {'infile': 'testdata0710.txt', 'annotation': None},
+    'synthetic50k': {'synthetic': 50000},
+    'synthetic200k': {'synthetic': 200000},
+}
+def make_synthetic_dataset(num_features, outdir, seed=0, fraction_significant=0.2):
+    '''
+    Feature table of num_features, with m/z and rtime resampled from the ineurons data plus jitter,
+    and p-values from a mixture of uniform and small values.
+    Annotation has one singleton empirical compound per feature, keyed by feature ID,
+    to be matched to the metabolic model as M+H+.
+
+    Return:
+        (infile, annotation) file names in outdir
+    '''
+    rng = np.random.default_rng(seed)
+    ref = np.loadtxt(os.path.join(TEST_DIR, 'ineurons_ttest_1127.tsv'), delimiter='\t',
+                     skiprows=1, usecols=(0, 1))
+    picks = rng.integers(0, ref.shape[0], num_features)
+    mz = np.round(ref[picks, 0] * (1 + rng.normal(0, 20e-6, num_features)), 4)
+    rtime = np.round(np.abs(ref[picks, 1] + rng.normal(0, 5, num_features)), 2)
+    pval = rng.random(num_features)
+    sig = rng.random(num_features) < fraction_significant
+    pval[sig] = pval[sig] * 0.01
+    statistic = np.round(rng.normal(0, 3, num_features), 3)
+
+    infile = 'synthetic_%d.tsv' %num_features
+    with open(os.path.join(outdir, infile), 'w') as O:
+        O.write('m/z\tretention_time\tp-value\tt-score\tfeature_id\n')
+        for ii in range(num_features):
+            O.write('%s\t%s\t%s\t%s\tSF%d\n' %(mz[ii], rtime[ii], pval[ii], statistic[ii], ii))
+
+    annotation = 'synthetic_%d.json' %num_features
+    EmpiricalCompounds = {}
+    for ii, (x, y) in enumerate(zip(mz.tolist(), rtime.tolist())):
+        if 50 < x < 2000:
+            fid = make_feature_id(ii + 1, x, y)
+            EmpiricalCompounds[fid] = {'interim_id': fid, 'neutral_formula_mass': None,
+                            'MS1_pseudo_Spectra': [{'id': fid, 'mz': x, 'rtime': y}]}
+    with open(os.path.join(outdir, annotation), 'w') as O:
+        json.dump(EmpiricalCompounds, O)
+    return infile, annotation
+
+
+def run_pipeline(parameters, workdir, model_cache=True):
+    '''
+    The stages of mummichog main(), recorded by stage() in the active trace.
+    JSON output is streamed by sections to a file in workdir, as by main().
+    '''
+    userData = InputUserData(parameters)
+    theoreticalModel = get_metabolic_model(parameters['network'],
+                                           cache_dir=None if model_cache else False)
+    mixedNetwork = DataMeetModel(theoreticalModel, userData)
+    PA, MA, AN = run_analyses(mixedNetwork)
+
+    outfile = os.path.join(workdir, 'mcg_output.json')
+    with stage('json_export') as r:
+        r['bytes'] = write_json_sections(json_export_sections(mixedNetwork, PA, MA, AN), outfile)
+    os.remove(outfile)
+
+
+def run_dataset(name, args, workdir):
+    spec = DATASETS[name]
+    if 'synthetic' in spec:
+        print("Generating %s ..." %name)
+        infile, annotation = make_synthetic_dataset(spec['synthetic'], workdir, seed=args.seed)
+        datadir = workdir
+    else:
+        infile, annotation, datadir = spec['infile'], spec['annotation'], TEST_DIR
+
+    parameters = PARAMETERS.copy()
+    parameters.update({'workdir': datadir, 'infile': infile, 'annotation': annotation,
+                       'permutation': args.permutation, 'seed': args.seed})
+    if args.network:
+        parameters['network'] = args.network
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    print("Running %s ..." %name)
+    trace = StageTrace(use_tracemalloc=args.tracemalloc)
+    out = sys.stdout if args.verbose else io.StringIO()
+    wall = time.perf_counter()
+    with active_trace(trace), contextlib.redirect_stdout(out):
+        run_pipeline(parameters, workdir, model_cache=not args.no_model_cache)
+    for record in trace.records:
+        print("    %-40s %8.3f s wall %8.3f s cpu" %('  ' * record['depth'] + record['stage'],
+                                                    record['wall_time'], record['cpu_time']))
+    return {'dataset': name,
+            'parameters': {k: v for k, v in parameters.items() if k in
+                           ['network', 'infile', 'annotation', 'permutation', 'cutoff', 'ppm', 'seed']},
+            'total_wall_time': time.perf_counter() - wall,
+            'stages': trace.records}
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(['git', '-C', REPO_DIR, 'rev-parse', 'HEAD'],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    import scipy, networkx
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': np.__version__, 'scipy': scipy.__version__, 'networkx': networkx.__version__,
+            'cpu_count': os.cpu_count()}
+
+
+def compare_results(new, old):
+    '''
+    Print wall time of each stage, old vs new, matched by dataset and stage.
+    '''
+    old_times = {(d['dataset'], s['stage']): s['wall_time'] for d in old['results'] for s in d['stages']}
+    print("\n%-14s %-36s %10s %10s %8s" %('dataset', 'stage', 'old (s)', 'new (s)', 'ratio'))
+    for d in new['results']:
+        for s in d['stages']:
+            t0 = old_times.get((d['dataset'], s['stage']))
+            if t0 is None:
+                continue
+            print("%-14s %-36s %10.3f %10.3f %8.2f" %(d['dataset'], s['stage'], t0, s['wall_time'],
+                                                     s['wall_time'] / t0 if t0 else float('nan')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mummichog end-to-end benchmark')
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS),
+                        default=['ineurons', 'testdata0710', 'synthetic50k', 'synthetic200k'])
+    parser.add_argument('-p', '--permutation', type=int, default=100,
+                        help='number of permutations')
+    parser.add_argument('-n', '--network', type=str, help='metabolic model')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='record peak Python allocation per stage (slower)')
+    parser.add_argument('--no-model-cache', action='store_true',
+                        help='load metabolic model without the compiled cache')
+    parser.add_argument('-o', '--output', type=str, default='bench_results.json',
+                        help='JSON file of results')
+    parser.add_argument('--compare', type=str, help='results JSON of an earlier run to compare to')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show mummichog output')
+    args = parser.parse_args()
+
+    results = {'environment': get_environment(), 'tracemalloc': args.tracemalloc, 'results': []}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.datasets:
+            results['results'].append(run_dataset(name, args, workdir))
+
+    with open(args.output, 'w') as O:
+        json.dump(results, O, indent=2)
+    print("Benchmark results were written in %s." %args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
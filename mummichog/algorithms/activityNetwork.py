@@ -6,6 +6,9 @@
 
 import networkx as nx
 
+from .modularAnalysis import MODULE_SIZE_LIMIT
+from ..stageTrace import stage
+
 
 class ActivityNetwork:
     '''
@@ -25,8 +28,12 @@ class ActivityNetwork:
         self.mixedNetwork = mixedNetwork
         self.network = mixedNetwork.model.network
         
-        nodes = [x[2] for x in hit_Trios]
-        self.activity_network = self.build_activity_network(nodes)
+        with stage('ActivityNetwork') as r:
+            nodes = [x[2] for x in hit_Trios]
+            self.activity_network = self.build_activity_network(nodes)
+            r['hit_Trios'] = len(hit_Trios)
+            r['nodes'] = self.activity_network.number_of_nodes()
+            r['edges'] = self.activity_network.number_of_edges()
 
     def build_activity_network(self, nodes, cutoff_ave_conn = 0.5, expected_size = 10):
         '''
@@ -0,0 +1,110 @@
+'''
+Batch Fisher exact test, one-sided (greater), for many 2x2 tables at once.
+
+For a pathway in a universe of total EmpiricalCompounds,
+    [[overlap_size, query_set_size - overlap_size],
+     [ecpd_num - overlap_size, negneg]]
+the right-tail p-value is the hypergeometric survival function P(X >= overlap_size),
+X ~ Hypergeom(total, ecpd_num, query_set_size), the same as
+stats.fisher_exact(table, 'greater')[1].
+
+All terms are computed in log space from a cached log-factorial table,
+so that p-values of all pathways (and all permutations) come from array operations.
+'''
+
+import numpy as np
+from scipy.special import gammaln
+
+# terms are summed in blocks, until the last term is negligible to the running sum
+TERM_BLOCK = 32
+TERM_EPSILON = 1e-17
+
+
+class BatchFisherTest:
+    '''
+    Hypergeometric survival function over arrays of
+    (overlap_size, pathway_size, query_size), for a fixed total.
+    The log-factorial table is sized to total and built once.
+
+    >>> F = BatchFisherTest(48)
+    >>> F.pvalues([12], [41], [17])     # same as stats.fisher_exact([[12, 5], [29, 2]], 'greater')[1]
+    array([0.99452521])
+    '''
+    def __init__(self, total):
+        self.total = int(total)
+        self.log_factorial = gammaln(np.arange(self.total + 1, dtype=np.float64) + 1)
+
+    def log_choose(self, n, k):
+        lf = self.log_factorial
+        return lf[n] - lf[k] - lf[n - k]
+
+    def log_pmf(self, k, n, N):
+        return self.log_choose(n, k) + self.log_choose(self.total - n, N - k) - self.log_choose(self.total, N)
+
+    def pvalues(self, overlap_size, pathway_size, query_size):
+        '''
+        Right-tail p-values of Fisher exact test, broadcasting over input arrays.
+        p = 1 if overlap_size is 0, as in PathwayAnalysis.
+        The shorter tail is summed: P(X >= a) if a is above the mode, else 1 - P(X <= a-1).
+
+        Return:
+            np.array of p-values, in the broadcast shape of inputs
+        '''
+        a, n, N = np.broadcast_arrays(np.asarray(overlap_size, dtype=np.int64),
+                                      np.asarray(pathway_size, dtype=np.int64),
+                                      np.asarray(query_size, dtype=np.int64))
+        shape = a.shape
+        a, n, N = a.ravel(), n.ravel(), N.ravel()
+        M = self.total
+        if a.size and max(n.max(), N.max()) > M:
+            raise ValueError("Pathway or query size larger than total %d." %M)
+
+        pvals = np.ones(a.size, dtype=np.float64)
+        # support of hypergeometric distribution; tail from kmin is 1
+        kmin = np.maximum(0, N - (M - n))
+        kmax = np.minimum(n, N)
+        pvals[(a > kmax) & (a > 0)] = 0.0
+        todo = (a > 0) & (a > kmin) & (a <= kmax)
+        mode = (N + 1) * (n + 1) // (M + 2)
+
+        upper = np.nonzero(todo & (a > mode))[0]
+        if upper.size:
+            pvals[upper] = self.__tail_sum__(a[upper], n[upper], N[upper], kmax[upper], step=1)
+        lower = np.nonzero(todo & (a <= mode))[0]
+        if lower.size:
+            pvals[lower] = 1 - self.__tail_sum__(a[lower] - 1, n[lower], N[lower], kmin[lower], step=-1)
+
+        return np.clip(pvals, 0.0, 1.0).reshape(shape)
+
+    def __tail_sum__(self, k0, n, N, kend, step):
+        '''
+        sum of pmf from k0 to kend (inclusive), going up (step=1) or down (step=-1).
+        k0 is on the decreasing side of the mode, so that terms are computed as
+        pmf(k0) times cumulative products of ratios, and summing stops once the terms are negligible.
+        '''
+        M = self.total
+        log_first = self.log_pmf(k0, n, N)
+        rel_sum = np.ones(k0.size)
+        term = np.ones(k0.size)
+        k = k0.copy()
+        rows = np.nonzero(k != kend)[0]
+        offsets = np.arange(1, TERM_BLOCK + 1)
+        while rows.size:
+            kk = k[rows, None] + step * offsets[None, :]
+            nn, NN = n[rows, None], N[rows, None]
+            if step > 0:
+                valid = kk <= kend[rows, None]
+                # pmf(k) / pmf(k-1)
+                num, den = (nn - kk + 1) * (NN - kk + 1), kk * (M - nn - NN + kk)
+            else:
+                valid = kk >= kend[rows, None]
+                # pmf(k) / pmf(k+1)
+                num, den = (kk + 1) * (M - nn - NN + kk + 1), (nn - kk) * (NN - kk)
+            ratio = np.where(valid, num / np.where(valid, den, 1), 0.0)
+            terms = term[rows, None] * np.cumprod(ratio, axis=1)
+            rel_sum[rows] += terms.sum(axis=1)
+            term[rows] = terms[:, -1]
+            k[rows] += step * TERM_BLOCK
+            rows = rows[term[rows] > TERM_EPSILON * rel_sum[rows]]
+
+        return np.exp(log_first + np.log(rel_sum))
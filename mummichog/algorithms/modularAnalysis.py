@@ -5,24 +5,34 @@
 #
 import sys
 import logging
-import random
 import itertools
+import multiprocessing
+from collections import OrderedDict
 import numpy as np
-from scipy import stats
+from scipy import sparse
+from scipy.sparse import csgraph
 import networkx as nx
 
+from .nullCache import NullCache, digest
+from ..annotate.trioStore import TrioStore
+from .randomStreams import MODULE_STREAM, run_entropy, permutation_rng
+from ..stageTrace import stage
+
 SEARCH_STEPS = 4
 MODULE_SIZE_LIMIT = 100
 SIGNIFICANCE_CUTOFF = 0.05   # to get from parameters later
 USE_DEBUG = False
+# Louvain seed in module splitting, fixed so that splits can be reused (SplitCache)
+SPLIT_SEED = 1
+SPLIT_CACHE_SIZE = 20000
 
-def find_communities(G, method='louvain'):
+def find_communities(G, method='louvain', seed=None):
     '''
     Wrapper of nx.community functions
     
     '''
     if method == 'louvain':
-        return nx.community.louvain_communities(G)
+        return nx.community.louvain_communities(G, seed=seed)
     elif method == 'Clauset-Newman-Moore':
         return nx.community.greedy_modularity_communities(G)
     elif method == 'girvan_newman':
@@ -31,8 +41,64 @@ def find_communities(G, method='louvain'):
         return [list(x) for x in coms]
     else:
         print("Warning, method not implemented")
+
+
+#
+# permutations in worker processes. 
+# The ModularAnalysis instance, including the read-only metabolic network,
+# is passed once to each worker by the pool initializer, not pickled per task.
+#
+_worker_analysis = None
+
+def _init_permutation_worker(analysis):
+    global _worker_analysis
+    _worker_analysis = analysis
+
+def _run_permutation_block(args):
+    entropy, start, stop = args
+    split_cache = _worker_analysis.split_cache
+    hits, misses = split_cache.hits, split_cache.misses
+    scores = _worker_analysis.permutation_scores(entropy, start, stop)
+    return scores, split_cache.hits - hits, split_cache.misses - misses
         
 
+class SplitCache:
+    '''
+    Bounded cache of module splits, {key: [node sets of communities]},
+    least recently used dropped first, with counts of hits and misses.
+    The same modules recur across permutations, as seeds are drawn from the same features
+    on the same network.
+    '''
+    def __init__(self, max_size=SPLIT_CACHE_SIZE):
+        self.max_size = max_size
+        self.store = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def get(self, key):
+        value = self.store.get(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.store.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.store[key] = value
+        if len(self.store) > self.max_size:
+            self.store.popitem(last=False)
+
+
+
+def trio_seeds(TrioList):
+    '''
+    Seeds of modules from a TrioList (TrioStore or list of tuples):
+        (set of seed cpds, number of seeds as Trios, {cpd: set of EmpCpds})
+    '''
+    if not isinstance(TrioList, TrioStore):
+        TrioList = TrioStore.from_tuples(TrioList)
+    return set(TrioList.unique('cpd')), len(TrioList), TrioList.cpd_EmpCpds()
+
 
 class Mmodule:
     '''
@@ -44,23 +110,25 @@ class Mmodule:
     need to record sig EmpCpds
     
     '''
-    def __init__(self, network, subgraph, TrioList):
+    def __init__(self, network, subgraph, TrioList, ref_degree=None, seeds=None):
         '''
         TrioList (seeds) format: [(M.row_number, EmpiricalCompounds, Cpd), ...]
         to keep tracking of where the EmpCpd came from (mzFeature).
         
-        network is the total parent metabolic network
+        network is the total parent metabolic network;
+        ref_degree is the precomputed {node: degree} of network, shared by all modules;
+        seeds is trio_seeds(TrioList), shared by all modules of the same TrioList.
         '''
         self.network = network
+        self.ref_degree = network.degree if ref_degree is None else ref_degree
         self.num_ref_edges = self.network.number_of_edges()
         self.num_ref_nodes = self.network.number_of_nodes()
         self.graph = subgraph.copy()
         
-        seed_cpds = [x[2] for x in TrioList]
+        seed_cpds, self.N_seeds, cpd_EmpCpds = seeds or trio_seeds(TrioList)
         self.shave(seed_cpds)
         self.nodestr = self.make_nodestr()
-        self.N_seeds = len(seed_cpds)
-        self.A = self.activity_score(seed_cpds, self.get_num_EmpCpd(TrioList))
+        self.A = self.activity_score(seed_cpds, self.get_num_EmpCpd(cpd_EmpCpds))
     
     def activity_score(self, seed_cpds, num_EmpCpd):
         '''
@@ -86,29 +154,28 @@ class Mmodule:
             return 0
         
         
-    def get_num_EmpCpd(self, TrioList):
-        new = []
-        subgraph_nodes = self.graph.nodes()
-        for x in TrioList:
-            if x[2] in subgraph_nodes:
-                new.append(x[1])
+    def get_num_EmpCpd(self, cpd_EmpCpds):
+        '''
+        number of EmpiricalCompounds of seed cpds in the module, cpd_EmpCpds as {cpd: set of EmpCpds}
+        '''
+        new = set()
+        for x in self.graph.nodes():
+            new.update(cpd_EmpCpds.get(x, ()))
                 
-        return len(set(new))
+        return len(new)
         
         
     def compute_modularity(self):
         '''
         To compute Newman-Girvan modularity for a single module,
         in reference to the whole network.
+        Expected edges sum over pairs ii != jj of degree(ii) * degree(jj), 
+        which is (sum of degrees)^2 - sum of squared degrees, in reference network degrees.
+        Integer sums keep the result identical to the pairwise loop.
         '''
         m = self.num_ref_edges
-        Nodes = self.graph.nodes()
-        expected = 0
-        for ii in Nodes:
-            for jj in Nodes:
-                if ii != jj:
-                    expected += self.network.degree(ii) * self.network.degree(jj)
-                    
+        degrees = [self.ref_degree[ii] for ii in self.graph.nodes()]
+        expected = sum(degrees)**2 - sum([d * d for d in degrees])
         expected /= (4.0 * m)
         self.Q = (self.graph.number_of_edges() - expected) / m
     
@@ -119,7 +186,7 @@ class Mmodule:
         '''
         m = float(self.graph.number_of_edges())
         expected = 0
-        for ii in self.graph.nodes(): expected += self.network.degree(ii)
+        for ii in self.graph.nodes(): expected += self.ref_degree[ii]
         self.Q = 2 * m * (np.sqrt(self.graph.number_of_nodes())) / expected
         
         
@@ -127,6 +194,7 @@ class Mmodule:
         '''
         shave off nodes that do not connect seeds, i.e.
         any node with degree = 1 and is not a seed, iteratively.
+        seed_cpds is a set.
         '''
         nonseeds = [x for x in self.graph.nodes() if x not in seed_cpds]
         excessive = [x for x in nonseeds if self.graph.degree(x)==1]
@@ -198,6 +266,12 @@ class ModularAnalysis:
         self.ref_featurelist = self.mixedNetwork.features
         self.significant_features = self.mixedNetwork.significant_features
         self.significant_Trios = self.mixedNetwork.TrioList
+        # degrees in reference network, for modularity of all modules
+        self.ref_degree = dict(self.network.degree())
+        # CSR adjacency on integer node indices, for neighbourhood expansion in find_modules
+        self.node_ids, self.indptr, self.indices = mixedNetwork.model.get_csr_adjacency()
+        self.node_index = dict(zip(self.node_ids, range(len(self.node_ids))))
+        self.split_cache = SplitCache()
         
 
     def dispatch(self):
@@ -212,10 +286,20 @@ class ModularAnalysis:
         '''
         s = "\nModular Analysis, using %d permutations ..." %self.paradict['permutation']
         print (s)
-        self.modules_from_significant_features = self.run_analysis_real()
-        self.permuation_mscores = self.do_permutations(self.paradict['permutation'])
+        with stage('ModularAnalysis.dispatch') as r:
+            with stage('ModularAnalysis.find_modules') as r2:
+                self.modules_from_significant_features = self.run_analysis_real()
+                r2['significant_Trios'] = len(self.significant_Trios)
+                r2['modules'] = len(self.modules_from_significant_features)
+            with stage('ModularAnalysis.do_permutations') as r2:
+                self.permuation_mscores = self.do_permutations(self.paradict['permutation'])
+                r2['permutations'] = self.paradict['permutation']
+                r2['random_modules'] = len(self.permuation_mscores)
+                r2['jobs'] = self.paradict.get('jobs', 1)
 
-        self.rank_significance()        
+            self.rank_significance()        
+            r['split_cache_hits'] = self.split_cache.hits
+            r['split_cache_misses'] = self.split_cache.misses
         #for M in self.top_modules: print(M, M.A, nx.average_node_connectivity(M.graph))
 
 
@@ -226,19 +310,98 @@ class ModularAnalysis:
     def do_permutations(self, num_perm):
         '''
         Run num_perm permutations on ref featurelist;
-        populate activity scores from random modules in self.permuation_mscores
-        
+        populate activity scores from random modules in self.permuation_mscores,
+        returned as np.array
+        
+        Permutation ii uses its own random stream, SeedSequence(entropy, spawn_key=(MODULE_STREAM, ii)),
+        so that the scores are the same for a given seed, serial or in paradict['jobs'] processes.
+        With paradict['seed'], scores are reused from the on-disk cache (see nullCache.py),
+        and only permutations beyond those cached are computed.
+        '''
+        entropy = run_entropy(self.paradict)
+        self.permutation_entropy = entropy
+        
+        # scores of all random modules, and number of modules per permutation
+        scores, counts = np.empty(0), np.empty(0, dtype=np.int64)
+        cache = NullCache.from_paradict(self.paradict)
+        if cache is not None:
+            key = self.null_cache_key(cache)
+            cached = cache.load(key)
+            if cached is not None:
+                scores, counts = cached['scores'], cached['counts']
+                print("Using %d permutations from cache." %min(len(counts), num_perm))
+        
+        if len(counts) < num_perm:
+            new = self.run_permutations(entropy, len(counts), num_perm)
+            scores = np.concatenate([scores, np.array([x for L in new for x in L], dtype=np.float64)])
+            counts = np.concatenate([counts, np.array([len(L) for L in new], dtype=np.int64)])
+            if cache is not None:
+                cache.save(key, scores=scores, counts=counts)
+        
+        return scores[:counts[:num_perm].sum()]
+    
+    def null_cache_key(self, cache):
+        '''
+        Key of module permutation scores, by reference mapping of features -> EmpCpds -> cpds,
+        network edges, N, seed, search parameters, Louvain seed and networkx version.
         '''
+        return cache.make_key('modules',
+                    self.mixedNetwork.reference_digest(),
+                    digest(self.network.edges()),
+                    len(self.significant_features),
+                    self.permutation_entropy,
+                    SEARCH_STEPS, MODULE_SIZE_LIMIT, SPLIT_SEED, nx.__version__)
+
+    def run_permutations(self, entropy, start, stop):
+        '''
+        Permutations start to stop-1, serial or in paradict['jobs'] processes.
+        
+        Return:
+            [[scores of random modules], ...] per permutation
+        '''
+        num_perm = stop - start
+        jobs = min(self.paradict.get('jobs', 1) or 1, num_perm)
+        if jobs < 2:
+            permuation_mscores = []
+            for ii in range(start, stop):
+                sys.stdout.write( ' ' + str(ii+1))
+                sys.stdout.flush()
+                permuation_mscores += self.permutation_scores(entropy, ii, ii+1)
+            return permuation_mscores
+        
+        # a few blocks per worker to balance load; results are collected in permutation order
+        block_size = max(1, num_perm // (4 * jobs))
+        blocks = [(entropy, ii, min(ii + block_size, stop)) for ii in range(start, stop, block_size)]
         permuation_mscores = []
-        N = len(self.significant_features)
-        for ii in range(num_perm):
-            sys.stdout.write( ' ' + str(ii+1))
-            sys.stdout.flush()
-            random_trios = self.mixedNetwork.batch_rowindex_EmpCpd_Cpd( 
-                                            random.sample(self.ref_featurelist, N) )
-            permuation_mscores += [x.A for x in self.find_modules(random_trios)] or [0]
+        with multiprocessing.Pool(jobs, initializer=_init_permutation_worker, initargs=(self,)) as pool:
+            for (_, _, block_stop), (scores, hits, misses) in zip(blocks, 
+                                                    pool.imap(_run_permutation_block, blocks)):
+                sys.stdout.write( ' ' + str(block_stop))
+                sys.stdout.flush()
+                permuation_mscores += scores
+                self.split_cache.hits += hits
+                self.split_cache.misses += misses
             
         return permuation_mscores
+    
+    def permutation_scores(self, entropy, start, stop):
+        '''
+        Activity scores of random modules from permutations start to stop-1, 
+        as a list per permutation ([0] if no module is found).
+        Feature sampling uses the random stream of each permutation.
+        '''
+        scores = []
+        N = len(self.significant_features)
+        EmpCpd_ids, cpd_ids = self.mixedNetwork.EmpCpd_ids, self.mixedNetwork.cpd_ids
+        for ii in range(start, stop):
+            rng = permutation_rng(entropy, MODULE_STREAM, ii)
+            rows = rng.choice(len(self.ref_featurelist), N, replace=False)
+            positions, EmpCpds, cpds = self.mixedNetwork.expand_EmpCpd_Cpd(self.mixedNetwork.feature_EmpCpd[rows])
+            # Trios for Mmodule, same as batch_rowindex_EmpCpd_Cpd on the random features
+            random_trios = TrioStore(self.ref_featurelist, EmpCpd_ids, cpd_ids, rows[positions], EmpCpds, cpds)
+            scores.append([x.A for x in self.find_modules(random_trios)] or [0])
+            
+        return scores
             
     def __generator_EmpiricalCompounds_cpds__(self, Ecpds):
         '''
@@ -258,39 +421,43 @@ class ModularAnalysis:
         A module is only counted if it contains more than one seeds.
         
         TrioList format: [(M.row_number, EmpiricalCompounds, Cpd), ...]
+        
+        Neighbourhoods are expanded on the CSR adjacency of network and split into 
+        connected components by scipy.sparse.csgraph; nx graphs are only made for
+        components within the size limits (see __expand_edges__, __make_module_graphs__).
+        Node and edge order of module graphs follow the expansion, not hashing of node IDs.
         '''
         global SEARCH_STEPS, MODULE_SIZE_LIMIT
-        seeds = [x[2] for x in TrioList]      # use cpd space
+        if not isinstance(TrioList, TrioStore):
+            TrioList = TrioStore.from_tuples(TrioList)
+        seeds = TrioList.column('cpd')      # use cpd space
+        shared_seeds = trio_seeds(TrioList)
         modules, modules2, module_nodes_list = [], [], []
-
+        
+        # seeds in network as integer indices, first occurrence kept as in nx.edges(network, seeds)
+        nodes = np.array([self.node_index[x] for x in dict.fromkeys(seeds) if x in self.node_index], 
+                         dtype=np.int64)
         for ii in range(SEARCH_STEPS):
-            edges = nx.edges(self.network, seeds)
-            if ii == 0:
-                # step 0, counting edges connecting seeds
-                edges = [x for x in edges if x[0] in seeds and x[1] in seeds]
-                new_network = nx.from_edgelist(edges)
-                
-            else:
-                # step 1, 2, 3, ... growing to include extra steps/connections
-                new_network = nx.from_edgelist(edges)
-                seeds = new_network.nodes()
+            # step 0, counting edges connecting seeds
+            # step 1, 2, 3, ... growing to include extra steps/connections
+            edges = self.__expand_edges__(nodes, seeds_only=(ii == 0))
+            new_nodes = self.__edgelist_nodes__(edges)
+            if ii > 0:
+                nodes = new_nodes
             
-            for sub in nx.connected_components(new_network):
-                sub = new_network.subgraph(sub)
-                if 3 < sub.number_of_nodes() < MODULE_SIZE_LIMIT:
-                    M = Mmodule(self.network, sub, TrioList)
-                    modules.append(M)
+            for sub in self.__make_module_graphs__(new_nodes, edges):
+                modules.append( Mmodule(self.network, sub, TrioList, self.ref_degree, shared_seeds) )
                 
         # add modules split from modules
         if USE_DEBUG:
-            logging.info( '# initialized network size = %d' %len(seeds) )
+            logging.info( '# initialized network size = %d' %len(nodes) )
             # need export modules for comparison to heinz
             self.__export_debug_modules__( modules )
             
         for sub in modules:
             if sub.graph.number_of_nodes() > 5:
-                modules2 += [Mmodule(self.network, x, TrioList)
-                             for x in self.__split_modules__(sub.graph)]
+                modules2 += [Mmodule(self.network, x, TrioList, self.ref_degree, shared_seeds)
+                             for x in self.__split_modules__(sub.graph, sub.nodestr)]
         
         new = []
         for M in modules + modules2:
@@ -302,6 +469,82 @@ class ModularAnalysis:
         return new
 
 
+    def __expand_edges__(self, nodes, seeds_only=False):
+        '''
+        Edges incident to nodes (integer indices, without repeats) in the same order as
+        nx.edges(network, nodes): by node, then by neighbor order, skipping neighbors visited before.
+        With seeds_only, only edges between nodes are kept.
+        
+        Return:
+            array of edges, shape (number of edges, 2)
+        '''
+        # rank of node in nodes, len(nodes) for other nodes
+        rank = np.full(len(self.node_ids), len(nodes), dtype=np.int64)
+        rank[nodes] = np.arange(len(nodes))
+        starts = self.indptr[nodes]
+        degrees = self.indptr[nodes + 1] - starts
+        total = int(degrees.sum())
+        k = np.repeat(np.arange(len(nodes)), degrees)
+        offsets = np.arange(total) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+        neighbors = np.asarray(self.indices)[np.repeat(starts, degrees) + offsets]
+        keep = rank[neighbors] >= k
+        if seeds_only:
+            keep &= rank[neighbors] < len(nodes)
+        return np.column_stack((nodes[k[keep]], neighbors[keep]))
+
+    def __edgelist_nodes__(self, edges):
+        '''
+        Nodes of nx.from_edgelist(edges), in order of first appearance
+        '''
+        flat = edges.ravel()
+        uniq, first = np.unique(flat, return_index=True)
+        return uniq[np.argsort(first)]
+
+    def __make_module_graphs__(self, nodes, edges):
+        '''
+        Connected components of the graph of edges, within 3 < size < MODULE_SIZE_LIMIT,
+        as nx graphs of the same nodes and edges as nx.from_edgelist(edges).subgraph(component)
+        of nx.connected_components, in order of their first node.
+        
+        nodes are the graph nodes in order of first appearance in edges.
+        '''
+        N = len(nodes)
+        if N == 0:
+            return []
+        local = np.empty(len(self.node_ids), dtype=np.int64)
+        local[nodes] = np.arange(N)
+        u, v = local[edges[:, 0]], local[edges[:, 1]]
+        A = sparse.csr_matrix((np.ones(len(u), dtype=np.int8), (u, v)), shape=(N, N))
+        num_components, labels = csgraph.connected_components(A, directed=False)
+        sizes = np.bincount(labels, minlength=num_components)
+        # components are found in order of their first node, as in nx.connected_components
+        _, first = np.unique(labels, return_index=True)
+        kept = [c for c in np.argsort(first).tolist() if 3 < sizes[c] < MODULE_SIZE_LIMIT]
+        if not kept:
+            return []
+        
+        # nodes and edges grouped by component, in graph order within each component
+        by_node = np.argsort(labels, kind='stable')
+        node_bounds = np.searchsorted(labels[by_node], np.arange(num_components + 1))
+        edge_labels = labels[u]
+        by_edge = np.argsort(edge_labels, kind='stable')
+        edge_bounds = np.searchsorted(edge_labels[by_edge], np.arange(num_components + 1))
+        
+        return [self.__component_graph__(nodes[by_node[node_bounds[c]: node_bounds[c+1]]],
+                                         edges[by_edge[edge_bounds[c]: edge_bounds[c+1]]])
+                for c in kept]
+    
+    def __component_graph__(self, comp_nodes, comp_edges):
+        '''
+        nx graph of a connected component, with nodes in graph order (comp_nodes)
+        and edges in edge list order (comp_edges), thus independent of hashing of node IDs.
+        '''
+        names = self.node_ids
+        G = nx.Graph()
+        G.add_nodes_from([names[x] for x in comp_nodes.tolist()])
+        G.add_edges_from([(names[a], names[b]) for a, b in comp_edges.tolist()])
+        return G
+
     def __export_debug_modules__(self, modules):
         '''
         write out initial modules, to be split by alternative algorithm
@@ -312,14 +555,37 @@ class ModularAnalysis:
         out.write(s + '#\n')
         out.close()
         
-    def __split_modules__(self, g):
+    def __split_modules__(self, g, nodestr):
         '''
         return nx.graph instance after splitting the input graph
         by Newman's spectral split method
         Only modules more than 3 nodes are considered as good small modules 
         should have been generated in 1st connecting step.
+        
+        Louvain is run with SPLIT_SEED on the graph in sorted node and edge order,
+        so that the split only depends on the graph, and is reused from self.split_cache,
+        keyed by nodestr and sorted edges (the same node set can have other edges).
+        '''
+        edges = sorted([tuple(sorted(e)) for e in g.edges()])
+        key = (nodestr, digest(edges))
+        communities = self.split_cache.get(key)
+        if communities is None:
+            canonical = nx.Graph()
+            canonical.add_nodes_from(sorted(g.nodes()))
+            canonical.add_edges_from(edges)
+            communities = [x for x in find_communities(canonical, seed=SPLIT_SEED) if len(x) > 3]
+            self.split_cache.put(key, communities)
+        return [self.__induced_graph__(g, x) for x in communities]
+
+    def __induced_graph__(self, g, nodes):
         '''
-        return [nx.subgraph(g, x) for x in find_communities(g) if len(x) > 3]
+        Subgraph of g on a set of nodes, in node and edge order of g.
+        A subgraph view would iterate the node set itself when it is small, in hash order of node IDs.
+        '''
+        G = nx.Graph()
+        G.add_nodes_from([x for x in g if x in nodes])
+        G.add_edges_from([e for e in g.edges() if e[0] in nodes and e[1] in nodes])
+        return G
 
 
     def rank_significance(self):
@@ -333,8 +599,11 @@ class ModularAnalysis:
                           %len(self.permuation_mscores))
         print("User data yield %d network modules" 
                           %len(self.modules_from_significant_features))
+        print("Module splitting cache: %d hits, %d misses" 
+                          %(self.split_cache.hits, self.split_cache.misses))
         
         if self.paradict['modeling'] == 'gamma':
+            from scipy import stats         # slow import, only needed here
             a, loc, scale = stats.gamma.fit(self.permuation_mscores)
             if USE_DEBUG:
                 logging.info( 'Gamma fit parameters a, loc, scale = ' + ', '.join([str(x) for x in [a, loc, scale]]) )
@@ -343,8 +612,10 @@ class ModularAnalysis:
                 M.p_value = 1 - stats.gamma.cdf(M.A, a, loc, scale)
             
         else:
-            for M in self.modules_from_significant_features:
-                M.p_value = self.__calculate_p__(M.A, self.permuation_mscores)
+            p_values = self.__calculate_p__([M.A for M in self.modules_from_significant_features], 
+                                            self.permuation_mscores)
+            for M, p in zip(self.modules_from_significant_features, p_values.tolist()):
+                M.p_value = p
                 
         top_modules = [M for M in self.modules_from_significant_features if M.p_value < SIGNIFICANCE_CUTOFF]
         self.top_modules = sorted(top_modules, key=lambda M: M.p_value)
@@ -355,12 +626,13 @@ class ModularAnalysis:
 
     def __calculate_p__(self, x, record):
         '''
-        calculate p-value based on the rank in record of scores
+        calculate p-values based on the rank in record of scores, in descending order,
+        for an array of x at once, by binary search in the sorted record.
+        Rank of x is the number of record scores above x, plus 1.
         '''
-        total_scores = [x] + record
-        total_scores.sort(reverse=True)
-        D = len(record) + 1.0
-        return (total_scores.index(x)+1)/D
+        sorted_record = np.sort(np.asarray(record, dtype=np.float64))
+        D = len(sorted_record) + 1.0
+        return (len(sorted_record) - np.searchsorted(sorted_record, x, side='right') + 1)/D
   
     def collect_hit_Trios(self):
         '''
@@ -372,16 +644,10 @@ class ModularAnalysis:
             overlap_Cpds += M.graph.nodes()
         
         overlap_Cpds = set(overlap_Cpds)
-        new = []
-        for T in self.significant_Trios:
-            if T[2] in overlap_Cpds:
-                # yet to sort this out
-                
-                # T[1].update_chosen_cpds(T[2])
-                # T[1].designate_face_cpd()
-                new.append(T)
-        
-        return new
+        # yet to sort this out
+        # T[1].update_chosen_cpds(T[2])
+        # T[1].designate_face_cpd()
+        return list(self.significant_Trios.select(self.significant_Trios.isin('cpd', overlap_Cpds)))
 
 
 
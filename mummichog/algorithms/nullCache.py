@@ -0,0 +1,114 @@
+'''
+On-disk cache of permutation records (null distributions) of pathway and module analysis.
+
+Permutation records depend only on the metabolic model, the reference mapping of
+features -> EmpiricalCompounds -> cpds, the size of significant list N and the random seed.
+Records are saved as .npz files named by a hash of these inputs,
+so that later runs with other cutoffs or annotation of significant features reuse them,
+and compute only the permutations beyond those cached (top-up).
+
+Caching requires a seed (paradict['seed']), since permutation ii is drawn from its own stream
+SeedSequence(seed, spawn_key=(analysis, ii)) (see randomStreams.py), 
+and cached records are only valid for the same streams.
+Total size is bounded by paradict['null_cache_size'] (MB), evicting least recently used files.
+'''
+
+import os
+import hashlib
+import numpy as np
+
+from ..models.model_cache import default_cache_dir
+
+# to change when permutation algorithms change results
+NULL_CACHE_VERSION = 3
+DEFAULT_CACHE_SIZE = 1024       # MB
+
+
+def digest(items):
+    '''
+    sha256 hex of an iterable of items, by their str representation
+    '''
+    h = hashlib.sha256()
+    for x in items:
+        h.update(str(x).encode('utf-8'))
+        h.update(b'\x1f')
+    return h.hexdigest()
+
+
+class NullCache:
+    '''
+    Directory of permutation records, as {key}.npz files.
+    '''
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_SIZE * 2**20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_paradict(cls, paradict):
+        '''
+        Return NullCache per paradict, or None if not used,
+        i.e. no seed, null_cache_dir is False or null_cache_size is 0.
+        '''
+        cache_dir = paradict.get('null_cache_dir', None)
+        size = paradict.get('null_cache_size', DEFAULT_CACHE_SIZE)
+        if paradict.get('seed', None) is None or cache_dir is False or not size:
+            return None
+        return cls(cache_dir or os.path.join(default_cache_dir(), 'nulls'), size * 2**20)
+
+    def make_key(self, kind, *parts):
+        return kind + '_' + digest([NULL_CACHE_VERSION, kind] + list(parts))[:32]
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        '''
+        Return {name: np.array} saved under key, or None.
+        Access time is recorded by file mtime, for LRU eviction.
+        '''
+        path = self.path(key)
+        try:
+            with np.load(path) as f:
+                arrays = {name: f[name] for name in f.files}
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return arrays
+
+    def save(self, key, **arrays):
+        '''
+        Write arrays under key, to a temporary file moved into place, then evict by size.
+        '''
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = self.path(key + '.tmp%d' %os.getpid())
+            np.savez(tmp, **arrays)
+            os.replace(tmp, self.path(key))
+            self.evict(keep=key)
+        except OSError as e:
+            print("Could not write permutation cache %s: %s" %(self.path(key), e))
+
+    def evict(self, keep=None):
+        '''
+        Remove least recently used records until total size is within max_bytes.
+        '''
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name, path))
+        total = sum([x[1] for x in entries])
+        for mtime, size, name, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == str(keep) + '.npz':
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
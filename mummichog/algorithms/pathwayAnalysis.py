@@ -1,11 +1,17 @@
 '''
 '''
 import sys
-import random
 import numpy as np
-from scipy import stats
+from scipy import sparse
+
+from .batchFisher import BatchFisherTest
+from .pathwayBitsets import PathwayBitsets, popcount
+from .nullCache import NullCache, digest
+from .randomStreams import PATHWAY_STREAM, run_entropy, permutation_rng
+from ..stageTrace import stage
 
 SIGNIFICANCE_CUTOFF = 0.05   # to get from parameters later
+PERMUTATION_BATCH_SIZE = 100  # permutations per sparse matrix product
 
 # Currency metabolites to be excluded in pathway/network analysis
 # Need to standardize IDs later
@@ -84,10 +90,14 @@ class PathwayAnalysis:
         
         # to help track wehre sig cpd comes from
         self.TrioList = self.mixedNetwork.TrioList
-        self.significant_EmpiricalCompounds = set([x[1] for x in self.TrioList])
+        self.significant_EmpiricalCompounds = set(self.TrioList.unique('EmpCpd'))
         
         self.DictOfEmpiricalCompounds = mixedNetwork.DictOfEmpiricalCompounds
         self.total_number_EmpiricalCompounds = len(self.DictOfEmpiricalCompounds)
+        # FET engine for all pathways at once, log-factorial table sized to total
+        self.fisher = BatchFisherTest(self.total_number_EmpiricalCompounds)
+        # random streams of permutations, from paradict['seed'] or drawn once per run
+        self.permutation_entropy = run_entropy(self.paradict)
 
         print("\nPathway Analysis...")
         
@@ -116,61 +126,171 @@ class PathwayAnalysis:
         return set(cpds_empirical)
         
         
-    def do_permutations(self, pathways, num_perm):
+    def do_permutations(self, pathways, num_perm, engine=None):
         '''
         Modified from Berriz et al 2003 method.
         After collecting p-values from resampling, do a Gamma fit.
         
         Permutation is simplified in version 2; no more new TableFeatures instances.
+        Permutation ii draws N random features from its own stream (see sample_feature_indices),
+        then p-values are computed by bitsets of EmpCpds from the Trio index (see __trio_permutation_pvalues__), 
+        or with paradict['permutation_engine'] == 'sparse', in batches of sparse matrix products 
+        (see __sparse_permutation_pvalues__). Both give the same values.
         
+        With paradict['seed'], records are reused from the on-disk cache (see nullCache.py),
+        and only permutations beyond those cached are computed.
+        permutation_record is ordered by permutation then pathway.
         
         May consider fitting Gamma at log scale, to be more accurate --
         
         '''
-        self.permutation_record = []
         print("Resampling, %d permutations to estimate background ..." 
                           %num_perm)
-        
-        # this is feature number not cpd number
-        N = len(self.mixedNetwork.significant_features)
-        for ii in range(num_perm):
-            sys.stdout.write( ' ' + str(ii + 1))
-            sys.stdout.flush()
-            random_Trios = self.mixedNetwork.batch_rowindex_EmpCpd_Cpd( 
-                                random.sample(self.mixedNetwork.features, N) )
+        with stage('PathwayAnalysis.do_permutations') as r:
+            cache = NullCache.from_paradict(self.paradict)
+            record = np.empty((0, len(pathways)))
+            if cache is not None:
+                key = self.null_cache_key(cache, pathways)
+                cached = cache.load(key)
+                if cached is not None and cached['record'].shape[1:] == (len(pathways),):
+                    record = cached['record']
+                    print("Using %d permutations from cache." %min(len(record), num_perm))
             
+            r['permutations'] = num_perm
+            r['cached_permutations'] = min(len(record), num_perm)
+            if len(record) < num_perm:
+                record = np.vstack([record, self.permutation_pvalues(pathways, len(record), num_perm, engine)])
+                if cache is not None:
+                    cache.save(key, record=record)
             
-            query_EmpiricalCompounds = set([x[1] for x in random_Trios])
-            self.permutation_record += (self.__calculate_p_ermutation_value__(
-                query_EmpiricalCompounds, pathways))
-        
+            self.permutation_record = record[:num_perm].ravel()
+            r['pathways'] = len(pathways)
         print("\nPathway background is estimated on %d random pathway values" 
                           %len(self.permutation_record))
         
+    def do_permutations_sparse(self, pathways, num_perm):
+        '''
+        do_permutations by sparse matrix products, regardless of paradict['permutation_engine'].
+        '''
+        return self.do_permutations(pathways, num_perm, engine='sparse')
+
+    def null_cache_key(self, cache, pathways):
+        '''
+        Key of pathway permutation record, by reference mapping of features -> EmpCpds -> cpds,
+        EmpCpds per pathway, total EmpCpds, N and seed.
+        '''
+        return cache.make_key('pathways', 
+                    self.mixedNetwork.reference_digest(),
+                    digest([sorted([str(E) for E in P.EmpiricalCompounds]) for P in pathways]),
+                    self.total_number_EmpiricalCompounds,
+                    len(self.mixedNetwork.significant_features),
+                    self.permutation_entropy)
+
+    def sample_feature_indices(self, ii):
+        '''
+        Indices of N random features (in mixedNetwork.features) in permutation ii,
+        from random stream SeedSequence(permutation_entropy, spawn_key=(PATHWAY_STREAM, ii)).
+        '''
+        N = len(self.mixedNetwork.significant_features)
+        num_features = len(self.mixedNetwork.features)
+        if N == 0:
+            return np.empty(0, dtype=np.int64)
+        rng = permutation_rng(self.permutation_entropy, PATHWAY_STREAM, ii)
+        return np.argpartition(rng.random(num_features), N - 1)[:N]
+
+    def permutation_pvalues(self, pathways, start, stop, engine=None, batch_size=PERMUTATION_BATCH_SIZE):
+        '''
+        FET p-values of pathways in permutations start to stop-1, in batches.
+        
+        Return:
+            np.array of shape (stop - start, len(pathways))
+        '''
+        engine = engine or self.paradict.get('permutation_engine', 'trio')
+        pathway_sizes = np.array([len(P.EmpiricalCompounds) for P in pathways])
+        if engine == 'sparse':
+            feature_EmpCpd, EmpCpd_pathway = self.get_incidence_matrices(pathways)
+        else:
+            bitsets = self.get_pathway_bitsets(pathways)
+        
+        values = [np.empty((0, len(pathways)))]
+        for ii in range(start, stop, batch_size):
+            jj = min(ii + batch_size, stop)
+            if engine == 'sparse':
+                values.append(self.__sparse_permutation_pvalues__(
+                    feature_EmpCpd, EmpCpd_pathway, pathway_sizes, ii, jj))
+            else:
+                values.append(self.__trio_permutation_pvalues__(bitsets, pathway_sizes, ii, jj))
+            sys.stdout.write( ' ' + str(jj))
+            sys.stdout.flush()
+        return np.vstack(values)
+
+    def __sparse_permutation_pvalues__(self, feature_EmpCpd, EmpCpd_pathway, pathway_sizes, start, stop):
+        '''
+        FET p-values of permutations start to stop-1 by sparse matrix products, 
+        using two precomputed incidence matrices, feature -> EmpiricalCompound and EmpiricalCompound -> pathway.
+        A batch of random feature samples is a sparse matrix S (permutations x features);
+        EmpCpds hit per permutation are nonzeros in S * F, 
+        and overlap counts for every (permutation, pathway) pair are (S * F > 0) * E.
+        
+        Return:
+            np.array of shape (stop - start, number of pathways in EmpCpd_pathway)
+        '''
+        batch = stop - start
+        num_features = feature_EmpCpd.shape[0]
+        N = len(self.mixedNetwork.significant_features)
+        samples = np.array([self.sample_feature_indices(ii) for ii in range(start, stop)], 
+                           dtype=np.int64).reshape(batch, N)
+        S = sparse.csr_matrix((np.ones(batch * N, dtype=np.int32), samples.ravel(), 
+                               np.arange(0, batch * N + 1, N) if N else np.zeros(batch + 1, dtype=np.int64)), 
+                              shape=(batch, num_features))
+        query = S @ feature_EmpCpd
+        query.data[:] = 1
+        query_sizes = np.diff(query.indptr)
+        overlaps = (query @ EmpCpd_pathway).toarray()
+        return self.fisher.pvalues(overlaps, pathway_sizes[None, :], query_sizes[:, None])
+
+    def __trio_permutation_pvalues__(self, bitsets, pathway_sizes, start, stop):
+        '''
+        FET p-values of permutations start to stop-1 by bitsets.
+        EmpCpds of random Trios, by the integer index of mixedNetwork, are packed into one query per permutation;
+        overlap counts for every (permutation, pathway) pair are popcounts of query & pathway bits.
+        
+        Return:
+            np.array of shape (stop - start, len(bitsets))
+        '''
+        feature_EmpCpd = self.mixedNetwork.feature_EmpCpd
+        queries = np.empty((stop - start, bitsets.bits.shape[1]), dtype=np.uint8)
+        for ii in range(start, stop):
+            hits = feature_EmpCpd[self.sample_feature_indices(ii)]
+            queries[ii - start] = bitsets.query(hits[hits >= 0])
+        query_sizes = popcount(queries).sum(axis=1, dtype=np.int64)
+        overlaps = bitsets.overlap_matrix(queries)
+        return self.fisher.pvalues(overlaps, pathway_sizes[None, :], query_sizes[:, None])
 
+    def get_pathway_bitsets(self, pathways):
+        '''
+        PathwayBitsets of EmpCpds per pathway, on the EmpCpd index of mixedNetwork.
+        '''
+        return PathwayBitsets([P.EmpiricalCompounds for P in pathways], self.mixedNetwork.EmpCpd_ids)
 
-    def __calculate_p_ermutation_value__(self, query_EmpiricalCompounds, pathways):
-        '''
-        calculate the FET p-value for all pathways.
-        But not save anything to Pathway instances.
-        '''
-        p_of_pathways = [ ]
-        query_set_size = len(query_EmpiricalCompounds)
-        total_feature_num = self.total_number_EmpiricalCompounds
-        
-        for P in pathways:
-            overlap_features = query_EmpiricalCompounds.intersection(P.EmpiricalCompounds)
-            overlap_size = len(overlap_features)
-            ecpd_num = len(P.EmpiricalCompounds)
-            if overlap_size > 0:
-                negneg = total_feature_num + overlap_size - ecpd_num - query_set_size
-                p_val = stats.fisher_exact([[overlap_size, query_set_size - overlap_size],
-                                       [ecpd_num - overlap_size, negneg]], 'greater')[1]
-                p_of_pathways.append(p_val)
-            else: 
-                p_of_pathways.append(1)
-                
-        return p_of_pathways
+    def get_incidence_matrices(self, pathways):
+        '''
+        Return:
+            sparse matrix of features -> EmpiricalCompounds, from mixedNetwork;
+            sparse matrix of EmpiricalCompounds -> pathways, on the same EmpCpd columns.
+        '''
+        feature_EmpCpd, EmpCpd_ids = self.mixedNetwork.get_feature_EmpCpd_matrix()
+        EmpCpd_index = dict(zip(EmpCpd_ids, range(len(EmpCpd_ids))))
+        rows, cols = [], []
+        for jj, P in enumerate(pathways):
+            for E in P.EmpiricalCompounds:
+                if E in EmpCpd_index:
+                    rows.append(EmpCpd_index[E])
+                    cols.append(jj)
+        
+        EmpCpd_pathway = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), 
+                                           shape=(len(EmpCpd_ids), len(pathways)))
+        return feature_EmpCpd, EmpCpd_pathway
 
 
     def get_adjust_p_by_permutations(self, pathways):
@@ -181,42 +301,121 @@ class PathwayAnalysis:
         to avoid redundant calculations.
         "Adjusted_p" is not an accurate term. It's rather a permutation based empirical p-value.
         '''
+        if self.paradict.get('permutation_mode', 'fixed') == 'adaptive':
+            with stage('PathwayAnalysis.sequential_permutations') as r:
+                pathways = self.get_adjust_p_by_sequential_permutations(pathways)
+                r['pathways'] = len(pathways)
+                r['permutations'] = sum(P.num_permutations for P in pathways)
+            return pathways
+        
         self.do_permutations(pathways, self.paradict['permutation'])
+        for P in pathways: P.num_permutations = self.paradict['permutation']
         
         if self.paradict['modeling'] == 'gamma':
+            from scipy import stats         # slow import, only needed here
             #vector_to_fit = [-np.log10(x) for x in self.permutation_record if x < 1]
-            vector_to_fit = -np.log10(np.array(self.permutation_record))
+            vector_to_fit = -np.log10(self.permutation_record)
             self.gamma = stats.gamma.fit(vector_to_fit)
             a, loc, scale = self.gamma
             
             for P in pathways: 
                 P.adjusted_p = self.__calculate_gamma_p__(a, loc, scale, P.p_EASE)
         else:
-            for P in pathways: P.adjusted_p = self.__calculate_p__(P.p_EASE, self.permutation_record)
+            adjusted_p = self.__calculate_p__([P.p_EASE for P in pathways], self.permutation_record)
+            for P, p in zip(pathways, adjusted_p.tolist()): P.adjusted_p = p
         return pathways
         
 
+    def get_adjust_p_by_sequential_permutations(self, pathways):
+        '''
+        Sequential Monte Carlo p-values, after Besag & Clifford (1991) Biometrika 78(2):301-304.
+        Each pathway is compared to its own null FET p-values, 
+        and sampling for a pathway stops once h null values at least as extreme as P.p_EASE 
+        (null <= P.p_EASE) are seen, with p = h/L at the L-th permutation. 
+        Ties count as exceedances, so pathways of p_EASE = 1 (empty or no overlap) stop at p = 1.
+        Pathways that do not stop by paradict['permutation'] permutations get p = (g+1)/(n+1), 
+        g exceedances in n permutations.
+        h = ceil(1/permutation_error**2), as relative standard error of p is about 1/sqrt(h).
+        
+        Only pathways still sampling are evaluated in each batch; batch size doubles up to PERMUTATION_BATCH_SIZE.
+        P.num_permutations records the number of permutations used per pathway.
+        '''
+        max_perm = self.paradict['permutation']
+        h = int(np.ceil(1 / self.paradict.get('permutation_error', 0.2)**2))
+        print("Resampling, sequential up to %d permutations, stopping at %d exceedances ..." 
+                          %(max_perm, h))
+        
+        use_sparse = self.paradict.get('permutation_engine', 'trio') == 'sparse'
+        pathway_sizes = np.array([len(P.EmpiricalCompounds) for P in pathways])
+        if use_sparse:
+            feature_EmpCpd, EmpCpd_pathway = self.get_incidence_matrices(pathways)
+            EmpCpd_pathway = EmpCpd_pathway.tocsc()
+        else:
+            bitsets = self.get_pathway_bitsets(pathways)
+        
+        observed = np.array([P.p_EASE for P in pathways], dtype=np.float64)
+        exceedances = np.zeros(len(pathways), dtype=np.int64)
+        used = np.zeros(len(pathways), dtype=np.int64)
+        stopped = np.zeros(len(pathways), dtype=bool)
+        active = np.arange(len(pathways))
+        done, batch_size = 0, h
+        permutation_record = []
+        while active.size and done < max_perm:
+            batch = min(batch_size, max_perm - done)
+            if use_sparse:
+                null = self.__sparse_permutation_pvalues__(feature_EmpCpd, EmpCpd_pathway[:, active], 
+                                                           pathway_sizes[active], done, done + batch)
+            else:
+                null = self.__trio_permutation_pvalues__(bitsets.subset(active), pathway_sizes[active], 
+                                                         done, done + batch)
+            permutation_record.append(null.ravel())
+            
+            # running count of exceedances per permutation; stop at the first permutation reaching h
+            counts = exceedances[active] + np.cumsum(null <= observed[active], axis=0)
+            reached = counts[-1] >= h
+            first = np.argmax(counts >= h, axis=0)
+            exceedances[active] = np.where(reached, h, counts[-1])
+            used[active] = done + np.where(reached, first + 1, batch)
+            stopped[active[reached]] = True
+            active = active[~reached]
+            done += batch
+            batch_size = min(2 * batch_size, PERMUTATION_BATCH_SIZE)
+            sys.stdout.write( ' ' + str(done))
+            sys.stdout.flush()
+        
+        self.permutation_record = np.concatenate(permutation_record or [np.empty(0)])
+        for P, g, L, s in zip(pathways, exceedances.tolist(), used.tolist(), stopped.tolist()):
+            P.num_permutations = L
+            P.adjusted_p = g / L if s else (g + 1) / (L + 1.0)
+        
+        print("\nSequential permutations: %d pathways stopped early, %d permutations in total" 
+                          %(stopped.sum(), done))
+        return pathways
+
     def __calculate_p__(self, x, record):
         '''
-        calculate p-value based on the rank in record of permutation p-values
+        calculate p-values based on the rank in record of permutation p-values,
+        for an array of x at once, by binary search in the sorted record.
+        Rank of x is the number of record values below x, plus 1, 
+        i.e. the first position of x after inserting x into sorted record.
         '''
-        total_scores = [x] + record
-        total_scores.sort()
-        D = len(record) + 1.0
-        return (total_scores.index(x)+1)/D
+        sorted_record = np.sort(np.asarray(record, dtype=np.float64))
+        D = len(sorted_record) + 1.0
+        return (np.searchsorted(sorted_record, x, side='left') + 1)/D
     
     def __calculate_gamma_p__(self, a, loc, scale, x):
         '''
         Use -log10 scale for model fitting
         '''
+        from scipy import stats
         return 1 - stats.gamma.cdf(-np.log10(x), a, loc, scale)
     
     
     def cpd_enrich_test(self):
         '''
         Fisher Exact Test in cpd space, after correction of detected cpds.
-        Fisher exact test is using scipy.stats.fisher_exact
-        for right-tail p-value:
+        Fisher exact test is computed for all pathways at once by BatchFisherTest,
+        same as right-tail p-value by scipy.stats.fisher_exact:
         >>> stats.fisher_exact([[12, 5], [29, 2]], 'greater')[1]
         0.99452520602188932
         
@@ -227,38 +426,35 @@ class PathwayAnalysis:
                         P.p_EASE = stats.fisher_exact([[max(0, overlap_size - 1), query_set_size - overlap_size],
                                    [ecpd_num - overlap_size + 1, negneg]], 'greater')[1]
         '''
-        FET_tested_pathways = []
-        qset = self.significant_EmpiricalCompounds
-        query_set_size = len(qset)
-        total_feature_num = self.total_number_EmpiricalCompounds
+        with stage('PathwayAnalysis.cpd_enrich_test') as r:
+            FET_tested_pathways = []
+            qset = self.significant_EmpiricalCompounds
+            query_set_size = len(qset)
         
-        print("Query number of significant compounds = %d compounds" %query_set_size)
+            print("Query number of significant compounds = %d compounds" %query_set_size)
         
-        for P in self.pathways:
-            # use the measured pathway size
-            P.overlap_EmpiricalCompounds = P.overlap_features = qset.intersection(P.EmpiricalCompounds)
+            for P in self.pathways:
+                # use the measured pathway size
+                P.overlap_EmpiricalCompounds = P.overlap_features = qset.intersection(P.EmpiricalCompounds)
 
-            P.overlap_size = overlap_size = len(P.overlap_EmpiricalCompounds)
-            P.EmpSize = ecpd_num = len(P.EmpiricalCompounds)
-            if overlap_size > 0:
-                negneg = total_feature_num + overlap_size - ecpd_num - query_set_size
-                # Fisher's exact test
-                P.p_FET = stats.fisher_exact([[overlap_size, query_set_size - overlap_size],
-                                   [ecpd_num - overlap_size, negneg]], 'greater')[1]
+                P.overlap_size = len(P.overlap_EmpiricalCompounds)
+                P.EmpSize = len(P.EmpiricalCompounds)
+                FET_tested_pathways.append(P)
+                #  (enrich_pvalue, overlap_size, overlap_features, P) 
+        
+            # Fisher's exact test; p = 1 if no overlap
+            p_values = self.fisher.pvalues([P.overlap_size for P in FET_tested_pathways], 
+                                           [P.EmpSize for P in FET_tested_pathways], query_set_size)
+            for P, p_val in zip(FET_tested_pathways, p_values.tolist()):
                 # EASE score as in Hosack et al 2003
                 # taking out EASE, as the new approach of EmpiricalCompound is quite stringent already
-                P.p_EASE = P.p_FET
-                
-
-            else:
-                P.p_FET = P.p_EASE = 1
-                
-            FET_tested_pathways.append(P)
-            #  (enrich_pvalue, overlap_size, overlap_features, P) 
+                P.p_FET = P.p_EASE = p_val
             
-        result = self.get_adjust_p_by_permutations(FET_tested_pathways)
-        result.sort(key=lambda x: x.adjusted_p, reverse=False)
-        self.resultListOfPathways = result
+            result = self.get_adjust_p_by_permutations(FET_tested_pathways)
+            result.sort(key=lambda x: x.adjusted_p, reverse=False)
+            self.resultListOfPathways = result
+            r['pathways'] = len(result)
+            r['significant_EmpiricalCompounds'] = query_set_size
 
     
     def collect_hit_Trios(self):
@@ -282,19 +478,14 @@ class PathwayAnalysis:
                 # print(P.adjusted_p, P.name)
                 overlap_EmpiricalCompounds = overlap_EmpiricalCompounds.union(P.overlap_EmpiricalCompounds)
         
-        new = []
-        for T in self.TrioList:
-            # [(mzFeature, EmpiricalCompound, cpd),...]
-            if T[1] in overlap_EmpiricalCompounds and T[0] in self.mixedNetwork.significant_features:
-                # this does not apply to all sig EmpCpd
-                
-                # yet to sort this out
-                
-                # T[1].update_chosen_cpds(T[2])
-                # T[1].designate_face_cpd()
-                new.append(T)
-        
-        return new
+        # [(mzFeature, EmpiricalCompound, cpd),...]
+        # this does not apply to all sig EmpCpd
+        # yet to sort this out
+        # T[1].update_chosen_cpds(T[2])
+        # T[1].designate_face_cpd()
+        hits = self.TrioList.isin('EmpCpd', overlap_EmpiricalCompounds) & self.TrioList.isin(
+                    'feature', set(self.mixedNetwork.significant_features))
+        return list(self.TrioList.select(hits))
                     
     def to_json(self):
         '''
@@ -322,6 +513,7 @@ class PathwayAnalysis:
                 'overlap_size': P.overlap_size,
                 'pathway_size': P.EmpSize,
                 'p-value': P.adjusted_p ,
+                'permutations': P.num_permutations,
                 'significant_empCpds': list(P.overlap_EmpiricalCompounds), # [ E.EID for E in ],
                 #
                 # yet to sort out
@@ -0,0 +1,106 @@
+'''
+Pathways x EmpiricalCompounds as packed bitsets, for overlap counts of many query sets.
+
+Each pathway is a row of bits over the EmpCpd index of DataMeetModel (EmpCpd_ids),
+packed 8 EmpCpds per byte as by np.packbits. A query set of EmpCpds is packed the same way,
+and its overlap with every pathway is the popcount of (pathway bits & query bits),
+summed over bytes. A batch of queries gives the (query, pathway) overlap matrix at once,
+in blocks to keep the temporary arrays small.
+
+This replaces set intersections of EmpCpd IDs per pathway and per permutation,
+where RECON3D-sized models have hundreds of pathways and permutations are thousands of query sets.
+'''
+
+import numpy as np
+
+# bytes of (query, pathway, byte) temporary array per block in overlap_matrix
+BLOCK_BYTES = 1 << 24
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count                 # numpy >= 2.0
+else:
+    _POPCOUNT_TABLE = np.array([bin(ii).count('1') for ii in range(256)], dtype=np.uint8)
+
+    def popcount(x):
+        return _POPCOUNT_TABLE[x]
+
+
+def pack_indices(indices, num_bits):
+    '''
+    Packed bitset (np.uint8 array, as np.packbits) with bits at indices set; repeats are allowed.
+    '''
+    bits = np.zeros((num_bits + 7) // 8, dtype=np.uint8)
+    indices = np.asarray(indices, dtype=np.int64)
+    np.bitwise_or.at(bits, indices >> 3, (128 >> (indices & 7)).astype(np.uint8))
+    return bits
+
+
+class PathwayBitsets:
+    '''
+    Packed bit rows of EmpCpds per pathway, on the columns of EmpCpd_ids.
+    EmpCpds not in EmpCpd_ids are not counted.
+
+    >>> B = PathwayBitsets([{'E1', 'E2'}, {'E2', 'E3'}, set()], ['E1', 'E2', 'E3', 'E4'])
+    >>> B.overlap_sizes(B.query_from_ids({'E2', 'E3'}))
+    array([1, 2, 0])
+    '''
+    def __init__(self, list_EmpiricalCompounds, EmpCpd_ids, bits=None):
+        self.EmpCpd_ids = EmpCpd_ids
+        self.num_EmpCpds = len(EmpCpd_ids)
+        if bits is None:
+            EmpCpd_index = dict(zip(EmpCpd_ids, range(self.num_EmpCpds)))
+            bits = np.zeros((len(list_EmpiricalCompounds), (self.num_EmpCpds + 7) // 8), dtype=np.uint8)
+            for jj, EmpCpds in enumerate(list_EmpiricalCompounds):
+                cols = [EmpCpd_index[E] for E in EmpCpds if E in EmpCpd_index]
+                if cols:
+                    bits[jj] = pack_indices(cols, self.num_EmpCpds)
+        self.bits = bits
+
+    def __len__(self):
+        return self.bits.shape[0]
+
+    def subset(self, rows):
+        '''
+        PathwayBitsets of pathways in rows (indices or boolean mask)
+        '''
+        return PathwayBitsets(None, self.EmpCpd_ids, self.bits[rows])
+
+    def sizes(self):
+        '''
+        number of EmpCpds per pathway
+        '''
+        return popcount(self.bits).sum(axis=1, dtype=np.int64)
+
+    def query(self, indices):
+        '''
+        Packed query of EmpCpds by index in EmpCpd_ids
+        '''
+        return pack_indices(indices, self.num_EmpCpds)
+
+    def query_from_ids(self, EmpCpds):
+        '''
+        Packed query of a set of EmpCpd IDs
+        '''
+        EmpCpd_index = dict(zip(self.EmpCpd_ids, range(self.num_EmpCpds)))
+        return self.query([EmpCpd_index[E] for E in EmpCpds if E in EmpCpd_index])
+
+    def overlap_sizes(self, query):
+        '''
+        Overlap of a packed query with every pathway, np.array of len(self)
+        '''
+        return popcount(self.bits & query).sum(axis=1, dtype=np.int64)
+
+    def overlap_matrix(self, queries):
+        '''
+        Overlaps of packed queries (one per row) with every pathway.
+
+        Return:
+            np.array of shape (number of queries, len(self))
+        '''
+        queries = np.atleast_2d(queries)
+        result = np.empty((queries.shape[0], len(self)), dtype=np.int64)
+        block = max(1, BLOCK_BYTES // max(1, self.bits.size))
+        for ii in range(0, queries.shape[0], block):
+            Q = queries[ii: ii + block]
+            result[ii: ii + block] = popcount(Q[:, None, :] & self.bits[None, :, :]).sum(axis=2, dtype=np.int64)
+        return result
@@ -0,0 +1,34 @@
+'''
+Random streams of permutations.
+
+All randomness of a run derives from one root seed, paradict['seed'],
+or fresh entropy drawn once per run if no seed is given (kept in paradict['entropy']).
+Each analysis has its own stream key, and permutation ii of an analysis draws from
+    SeedSequence(root seed, spawn_key=(analysis stream, ii)),
+so that results are identical regardless of the number of worker processes, batches or
+permutations cached before, and the streams of different analyses are independent.
+'''
+
+import numpy as np
+
+PATHWAY_STREAM = 1            # spawn_key prefix of random streams in pathway permutations
+MODULE_STREAM = 2             # spawn_key prefix of random streams in module permutations
+
+
+def run_entropy(paradict):
+    '''
+    Root seed of the run, paradict['seed'] if given,
+    otherwise drawn once and kept in paradict['entropy'] for all analyses of the run.
+    '''
+    if paradict.get('seed', None) is not None:
+        return paradict['seed']
+    if paradict.get('entropy', None) is None:
+        paradict['entropy'] = np.random.SeedSequence().entropy
+    return paradict['entropy']
+
+
+def permutation_rng(entropy, stream, ii):
+    '''
+    numpy Generator of permutation ii in the given analysis stream
+    '''
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(stream, ii)))
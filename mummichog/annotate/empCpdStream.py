@@ -0,0 +1,166 @@
+'''
+Streaming loader of empirical compound annotation in JSON,
+as {interim_id: empCpd, ...} (or a list of empCpds), plain or compressed (.json.gz, .json.zip).
+
+Empirical compounds are decoded one at a time from a text buffer,
+and reduced to the fields used in mummichog before the next one is read,
+so that MS2_Spectra and other heavy blocks are never held for the whole file.
+'''
+
+import io
+import json
+import gzip
+import zipfile
+
+CHUNK_SIZE = 1 << 20
+
+# fields kept per empirical compound, per MS1 feature and per database annotation entry
+EMPCPD_FIELDS = ('interim_id', 'neutral_formula_mass', 'neutral_formula', 'identity',
+                 'MS1_pseudo_Spectra', 'annotation')
+FEATURE_FIELDS = ('id', 'id_number', 'feature_id', 'mz', 'rtime',
+                  'isotope', 'modification', 'ion_relation')
+ANNOTATION_FIELDS = ('accession', 'cpd', 'reference_id', 'name')
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+# characters that can follow a complete value
+_DELIMITERS = _WHITESPACE + ',:]}'
+
+
+def open_annotation_file(path):
+    '''
+    Return text stream of a JSON file, .json.gz or .json.zip.
+    In a zip archive, the first .json member is used (skipping __MACOSX/ entries).
+    '''
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    elif path.endswith('.zip'):
+        archive = zipfile.ZipFile(path)
+        members = [x for x in archive.namelist() if x.endswith('.json') and not x.startswith('__MACOSX')]
+        if not members:
+            raise ValueError("No JSON file found in %s." %path)
+        return io.TextIOWrapper(archive.open(members[0]), encoding='utf-8')
+    else:
+        return open(path, encoding='utf-8')
+
+
+def slim_empCpd(empCpd):
+    '''
+    Keep only fields used by mummichog: interim_id, neutral_formula_mass, identity,
+    MS1_pseudo_Spectra (feature ids, m/z and ions) and annotation accessions.
+    '''
+    new = {k: empCpd[k] for k in EMPCPD_FIELDS if k in empCpd}
+    new['MS1_pseudo_Spectra'] = [{k: x[k] for k in FEATURE_FIELDS if k in x}
+                                 for x in empCpd.get('MS1_pseudo_Spectra', [])]
+    if 'annotation' in empCpd:
+        new['annotation'] = {db: [{k: x[k] for k in ANNOTATION_FIELDS if k in x}
+                                  for x in entries if isinstance(x, dict)]
+                             for db, entries in empCpd['annotation'].items()}
+    return new
+
+
+class _JSONStream:
+    '''
+    Incremental reader of JSON values from a text stream, by json.JSONDecoder.raw_decode.
+    The buffer is extended by chunks when a value is incomplete.
+    '''
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def __fill__(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        '''
+        next non-whitespace character, consumed
+        '''
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                self.pos += 1
+                return self.buffer[self.pos - 1]
+            if not self.__fill__():
+                raise ValueError("Unexpected end of JSON file.")
+
+    def peek_char(self):
+        c = self.next_char()
+        self.pos -= 1
+        return c
+
+    def value(self):
+        '''
+        decode next JSON value
+        '''
+        self.peek_char()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of buffer may be cut, e.g. '1.' from '1.25'
+                if self.eof or (end < len(self.buffer) and self.buffer[end] in _DELIMITERS):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.__fill__()
+
+
+def iter_empCpds(f, chunk_size=CHUNK_SIZE):
+    '''
+    Yield (key, empCpd) from a text stream of JSON,
+    either {key: empCpd, ...} or [empCpd, ...], keyed by interim_id in the latter case.
+    '''
+    S = _JSONStream(f, chunk_size)
+    opening = S.next_char()
+    if opening == '{':
+        if S.peek_char() == '}':
+            return
+        while True:
+            key = S.value()
+            if S.next_char() != ':':
+                raise ValueError("Invalid JSON annotation file, expecting ':'.")
+            yield key, S.value()
+            c = S.next_char()
+            if c == '}':
+                return
+            elif c != ',':
+                raise ValueError("Invalid JSON annotation file, expecting ',' or '}'.")
+    elif opening == '[':
+        if S.peek_char() == ']':
+            return
+        while True:
+            empCpd = S.value()
+            yield empCpd['interim_id'], empCpd
+            c = S.next_char()
+            if c == ']':
+                return
+            elif c != ',':
+                raise ValueError("Invalid JSON annotation file, expecting ',' or ']'.")
+    else:
+        raise ValueError("Invalid JSON annotation file, expecting a dict or list of empirical compounds.")
+
+
+def load_empCpds(path, slim=True):
+    '''
+    Load empirical compounds from a JSON file (.json, .json.gz or .json.zip) by streaming.
+    With slim=False, all fields are kept.
+
+    Return:
+        {key: empCpd, ...}
+    '''
+    EmpiricalCompounds = {}
+    with open_annotation_file(path) as f:
+        for key, empCpd in iter_empCpds(f):
+            EmpiricalCompounds[key] = slim_empCpd(empCpd) if slim else empCpd
+    return EmpiricalCompounds
@@ -0,0 +1,144 @@
+'''
+Columnar table of user features,
+as NumPy arrays of mz, rtime, pval and statistic, plus arrays of interned feature IDs.
+
+This replaces one dict per feature in InputUserData.
+The dict format is still available per row, e.g.
+{'id_number': 'F1_378.2121@26.68', 'id': 'F1_378.2121@26.68', 'fid_from_user': 'F21829',
+ 'mz': 378.2121, 'rtime': 26.68, 'pval': 1.58e-16, 'statistic': 13952.6, 'is_significant': True}
+
+'''
+
+import sys
+from collections.abc import Mapping
+import numpy as np
+
+MASS_RANGE = (50, 2000)
+
+
+def make_feature_id(ii, mz, rt):
+    return 'F' + str(ii) + '_' + str(round(mz, 6)) + '@' + str(round(rt, 2))
+
+
+class FeatureTable:
+    '''
+    Features in columns. Row order is the order in input file, after m/z range filter.
+    row_numbers are human-friendly row numbers in input file, numbering from 1.
+    is_significant is a boolean mask, set by InputUserData.determine_significant_list.
+    '''
+    def __init__(self, ids, fid_from_user, mz, rtime, pval, statistic, row_numbers):
+        self.ids = ids
+        self.fid_from_user = fid_from_user
+        self.mz = mz
+        self.rtime = rtime
+        self.pval = pval
+        self.statistic = statistic
+        self.row_numbers = row_numbers
+        self.is_significant = np.zeros(len(ids), dtype=bool)
+        self.excluded = []
+        self.__index = None
+
+    @classmethod
+    def from_text(cls, lines, delimiter='\t', mass_range=MASS_RANGE, columns=(0, 1, 2, 3), id_column=4):
+        '''
+        Bulk parser of delimited text, lines with header.
+        Default column order is mz, retention_time, p_value, statistic, CompoundID_from_user;
+        columns gives the (mz, retention_time, p_value, statistic) column indices otherwise,
+        and id_column that of CompoundID_from_user (None if absent).
+        Numeric columns are parsed in one np.loadtxt call; features out of mass_range are excluded,
+        and kept in .excluded as (row index, mz, rtime).
+        '''
+        body = lines[1:]
+        values = np.loadtxt(body, delimiter=delimiter, usecols=columns,
+                            dtype=np.float64, ndmin=2, comments=None)
+        if values.shape[0] != len(body):
+            raise ValueError("Could not parse %d rows of feature table." %(len(body) - values.shape[0]))
+        mz, rtime, pval, statistic = values.T
+        keep = (mass_range[0] < mz) & (mz < mass_range[1])
+        kept_rows = np.nonzero(keep)[0]
+
+        # row # human-friendly, numbering from 1
+        row_numbers = kept_rows + 1
+        ids = [sys.intern(make_feature_id(ii, x, y)) for ii, x, y in
+               zip(row_numbers.tolist(), mz[keep].tolist(), rtime[keep].tolist())]
+        fid_from_user = ids
+        if id_column is not None and any([x.count(delimiter) >= id_column for x in body]):
+            user_ids = [y[id_column].strip() if len(y) > id_column else '' for y in
+                        (body[ii].split(delimiter, id_column + 1) for ii in kept_rows.tolist())]
+            fid_from_user = [sys.intern(x) if x else fid for x, fid in zip(user_ids, ids)]
+
+        T = cls(np.array(ids, dtype=object), np.array(fid_from_user, dtype=object),
+                mz[keep], rtime[keep], pval[keep], statistic[keep], row_numbers)
+        excluded_rows = np.nonzero(~keep)[0]
+        T.excluded = list(zip(excluded_rows.tolist(), mz[~keep].tolist(), rtime[~keep].tolist()))
+        return T
+
+    def with_values(self, pval, statistic):
+        '''
+        New FeatureTable of the same features, sharing ID, mz and rtime arrays,
+        with other pval and statistic columns (aligned to rows), e.g. per contrast in batch mode.
+        '''
+        if len(pval) != len(self.ids) or len(statistic) != len(self.ids):
+            raise ValueError("pval and statistic must have one value per feature.")
+        T = FeatureTable(self.ids, self.fid_from_user, self.mz, self.rtime,
+                         np.asarray(pval, dtype=np.float64), np.asarray(statistic, dtype=np.float64),
+                         self.row_numbers)
+        T.excluded = self.excluded
+        T.__index = self.__index
+        return T
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def index(self):
+        '''
+        {feature id: row}, built on first use
+        '''
+        if self.__index is None:
+            self.__index = dict(zip(self.ids.tolist(), range(len(self.ids))))
+        return self.__index
+
+    def in_mz_range(self, mz_range):
+        '''
+        boolean mask of features within mz_range (exclusive)
+        '''
+        return (mz_range[0] < self.mz) & (self.mz < mz_range[1])
+
+    def row(self, ii):
+        '''
+        Feature at row ii in dict format
+        '''
+        return {'id_number': self.ids[ii],
+                'id': self.ids[ii],
+                'fid_from_user': self.fid_from_user[ii],
+                'mz': float(self.mz[ii]),
+                'rtime': float(self.rtime[ii]),
+                'pval': float(self.pval[ii]),
+                'statistic': float(self.statistic[ii]),
+                'is_significant': bool(self.is_significant[ii]),
+                }
+
+    def to_dicts(self):
+        return [self.row(ii) for ii in range(len(self.ids))]
+
+
+class FeatureRows(Mapping):
+    '''
+    Read-only {feature id: feature dict} view of a FeatureTable,
+    with dicts made on lookup, e.g. DataMeetModel.rowDict.
+    '''
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, fid):
+        return self.table.row(self.table.index[fid])
+
+    def __contains__(self, fid):
+        return fid in self.table.index
+
+    def __iter__(self):
+        return iter(self.table.ids.tolist())
+
+    def __len__(self):
+        return len(self.table)
@@ -52,6 +52,14 @@ Example of empirical compound JSON format:
 
 '''
 import json
+import copy
+import numpy as np
+from scipy import sparse
+
+from .featureTable import FeatureRows
+from .trioStore import TrioStore
+from ..algorithms.nullCache import digest
+from ..stageTrace import stage
 
 MASS_RANGE = (50, 2000)
 RETENTION_TIME_TOLERANCE_FRAC = 0.02    
@@ -111,79 +119,138 @@ class DataMeetModel:
         (FeatureID, EmpiricalCompounds, Cpd)
         
         '''
-        self.model = metabolicModel
-        self.data = userData
-        self.rowDict = {f['id']: f for f in self.data.ListOfUserFeatures}
-        # this is the sig list
-        self.significant_features = self.data.input_featurelist
-        # this is the reference list
-        self.features = [f['id'] for f in self.data.ListOfUserFeatures] # feature IDs
-        self.DictOfEmpiricalCompounds = self.get_score_EmpiricalCompounds() 
-        
-        self.feature_to_EmpiricalCompound, self.Compound_to_EmpiricalCompounds, \
-            self.TrioList = self.index_EmpCpd_Cpd()
+        with stage('DataMeetModel') as r:
+            self.model = metabolicModel
+            self.data = userData
+            # {feature id: feature dict}, looked up in the columns of FeatureTable
+            self.rowDict = FeatureRows(self.data.FeatureTable)
+            # this is the sig list
+            self.significant_features = self.data.input_featurelist
+            # this is the reference list
+            self.features = self.data.FeatureTable.ids.tolist() # feature IDs
+            self.DictOfEmpiricalCompounds = self.get_score_EmpiricalCompounds() 
+            
+            self.feature_to_EmpiricalCompound, self.Compound_to_EmpiricalCompounds, \
+                self.TrioList = self.index_EmpCpd_Cpd()
+            # integer index of the same mapping, for permutations
+            self.index_EmpCpd_Cpd_arrays()
+            r['EmpiricalCompounds'] = len(self.DictOfEmpiricalCompounds)
+            r['Trios'] = len(self.TrioList)
 
             
+    def for_contrast(self, userData):
+        '''
+        DataMeetModel for another contrast of the same features and annotation,
+        e.g. other p-values in batch mode, sharing model, EmpiricalCompounds and Trio indexes.
+        Only userData (paradict, significant list) differs;
+        userData.FeatureTable must have the same feature IDs as self.data.FeatureTable.
+        '''
+        if userData.FeatureTable.ids is not self.data.FeatureTable.ids and \
+                userData.FeatureTable.ids.tolist() != self.features:
+            raise ValueError("Contrast has different features from the mapped feature table.")
+        new = copy.copy(self)
+        new.data = userData
+        new.rowDict = FeatureRows(userData.FeatureTable)
+        new.significant_features = userData.input_featurelist
+        return new
+
     def get_score_EmpiricalCompounds(self):
         '''
         EmpiricalCompounds should be already constructed in userData. 
         If not, do it here.
         
         Singletons may have matched neutral_formula using primary ions. 
-        If not, deal wtih singletons, as M+H+ or M-H- forms.
+        If not, singletons are matched by m/z to ions of model compounds 
+        in the adduct table of paradict['mode'] (see batch_match_singletons).
+        Without annotation, every feature is a singleton.
         
         Need to make sure cpd IDs are consistent with those in metabolic model.
         '''
         
         
         if not self.data.EmpiricalCompounds:
-            # construct from scratch using khipu
-            
-            pass
+            # construct from scratch using khipu; singletons for now
+            self.data.EmpiricalCompounds = self.make_singleton_EmpiricalCompounds()
         
+        singletons, annotated = [], []
         for empCpd in self.data.EmpiricalCompounds.values():
             # first deal with singletons
             if not empCpd['neutral_formula_mass']:
-                empCpd['cpd_scores'] = {}
-                mz = empCpd['MS1_pseudo_Spectra'][0]['mz']
-                if self.data.paradict.get('ionization', 'pos') == 'pos':
-                    empCpd['neutral_formula_mass'] = mz - 1.007276
-                else:
-                    empCpd['neutral_formula_mass'] = mz + 1.007276
+                singletons.append(empCpd)
                 
             else: # khipu should have some annotation already
                 # {cpd_id: score, ...}
                 empCpd['cpd_scores'] = score_cpd_identity(empCpd)
+                annotated.append(empCpd)
                 
-            # add new round of matching to metabolic model here
-            self.augment_empCpd_with_model_cpds(empCpd)
+        self.batch_match_singletons(singletons)
+        # add new round of matching to metabolic model here, in one batch
+        self.batch_augment_empCpds_with_model_cpds(annotated)
         
         return self.data.EmpiricalCompounds   # dict
 
+    def make_singleton_EmpiricalCompounds(self):
+        '''
+        One singleton empirical compound per feature of the input table, keyed by feature ID,
+        for data without annotation file.
+        '''
+        T = self.data.FeatureTable
+        return {fid: {'interim_id': fid, 'neutral_formula_mass': None,
+                      'MS1_pseudo_Spectra': [{'id': fid, 'mz': mz, 'rtime': rtime}]}
+                for fid, mz, rtime in zip(T.ids.tolist(), T.mz.tolist(), T.rtime.tolist())}
 
-    def augment_empCpd_with_model_cpds(self, empCpd):
+    def batch_match_singletons(self, list_empCpds):
         '''
-        Given an empirical compound, augment its identity list with compounds
+        Match singleton empirical compounds to model compounds by the m/z of their feature,
+        against all ions (H, Na, K, NH4, 13C, etc.) of model compounds in the ionization mode,
+        paradict['mode'], in one sorted join over model.get_adduct_index(mode).
+        
+        Update empCpds in place:
+            cpd_scores, {cpd_id: default score, ...} and
+            matched_ions, {cpd_id: ion, ...}, e.g. {'C00031': 'M+Na[1+]'}.
+        '''
+        ppm = self.data.paradict['ppm'] or 10
+        adduct_index = self.model.get_adduct_index(self.data.paradict.get('mode', 'pos_default'))
+        list_matches = adduct_index.batch_query(
+            [empCpd['MS1_pseudo_Spectra'][0]['mz'] for empCpd in list_empCpds], ppm)
+        
+        for empCpd, matches in zip(list_empCpds, list_matches):
+            empCpd['cpd_scores'] = {cpd_id: 0.05 for cpd_id, ion in matches}
+            empCpd['matched_ions'] = dict(matches)
+
+
+    def batch_augment_empCpds_with_model_cpds(self, list_empCpds):
+        '''
+        Given a list of empirical compounds, augment their identity lists with compounds
         from metabolic model, based on neutral_formula_mass matching.
+        All masses are queried in one pass against model.mass_index.
         
-        Update empCpd in place.
+        Update empCpds in place.
         
         '''
         ppm = self.data.paradict['ppm'] or 10
-        mass_tol = ppm * empCpd['neutral_formula_mass'] / 1e6
-        matched_cpds = []
         #
         # yet to sort this out - to standardize cpd IDs
         #
-        for cpd_id, cpd in self.model.Compounds.items():
-            if cpd['mw']:  # only consider those with mw
-                if abs(cpd['mw'] - empCpd['neutral_formula_mass']) <= mass_tol:
-                    matched_cpds.append(cpd_id)
+        list_matched_cpds = self.model.mass_index.batch_query(
+            [empCpd['neutral_formula_mass'] for empCpd in list_empCpds], ppm)
         
         # add matched_cpds to identity list with default score
-        for cpd_id in matched_cpds:
-            if cpd_id not in empCpd['cpd_scores']:
-                empCpd['cpd_scores'][cpd_id] = 0.05    # default score for model-matched IDs
+        for empCpd, matched_cpds in zip(list_empCpds, list_matched_cpds):
+            for cpd_id in matched_cpds:
+                if cpd_id not in empCpd['cpd_scores']:
+                    empCpd['cpd_scores'][cpd_id] = 0.05    # default score for model-matched IDs
+
+
+    def augment_empCpd_with_model_cpds(self, empCpd):
+        '''
+        Given an empirical compound, augment its identity list with compounds
+        from metabolic model, based on neutral_formula_mass matching.
+        
+        Update empCpd in place.
+        
+        '''
+        self.batch_augment_empCpds_with_model_cpds([empCpd])
 
 
     def index_EmpCpd_Cpd(self):
@@ -194,16 +261,15 @@ class DataMeetModel:
         Only those in self.features are used to build TrioList.
         
         Cpd IDs have to be consistent with those in metabolic model (self.get_DictOfEmpiricalCompounds).
-        Singletons are matched to model as M+H+ or M-H-.
+        Singletons are matched to model by adducts of paradict['mode'].
         
         Return:
             feature_to_EmpiricalCompounds: {feature: [EmpiricalCompounds, ...], ...}
             Compounds_to_EmpiricalCompounds: {cpd: [EmpiricalCompounds, ...], ...}
-            TrioList: [(feature, EmpiricalCompounds, cpd), ...]
+            TrioList: TrioStore of [(feature, EmpiricalCompounds, cpd), ...]
         
         '''
         feature_to_EmpiricalCompounds, cpd2EmpiricalCompounds = {}, {}
-        TrioList = []
         for empCpd in self.DictOfEmpiricalCompounds.values():
             for feat in empCpd['MS1_pseudo_Spectra']:
                 feature_to_EmpiricalCompounds[feat['id']] = empCpd['interim_id']
@@ -211,29 +277,119 @@ class DataMeetModel:
                 if cpd not in cpd2EmpiricalCompounds:
                     cpd2EmpiricalCompounds[cpd] = []
                 cpd2EmpiricalCompounds[cpd] += [empCpd['interim_id']]
-                for feat in empCpd['MS1_pseudo_Spectra']:
-                    TrioList.append( (feat['id'], empCpd['interim_id'], cpd) )
-                    
+        
+        # Trios as integer codes; iterating gives the (feature, EmpCpd, cpd) tuples
+        TrioList = TrioStore.from_EmpiricalCompounds(self.DictOfEmpiricalCompounds.values())
         return feature_to_EmpiricalCompounds, cpd2EmpiricalCompounds, TrioList
 
     
+    def index_EmpCpd_Cpd_arrays(self):
+        '''
+        Integer index of feature -> EmpiricalCompound -> cpd mapping, 
+        only EmpCpds that have cpds (others produce no Trios), numbered in order of first feature.
+        
+        Sets:
+            EmpCpd_ids, cpd_ids: lists of IDs by index
+            feature_EmpCpd_index: {feature: EmpCpd index}, for any feature in feature_to_EmpiricalCompound
+            feature_EmpCpd: EmpCpd index of each reference feature (self.features), -1 if none,
+                as a feature maps to at most one EmpCpd
+            EmpCpd_cpd_indptr, EmpCpd_cpd_indices: CSR arrays of EmpCpd -> cpd indices, in cpd_scores order
+        '''
+        # feature_to_EmpiricalCompound points to interim_id, which is not always the dict key
+        cpd_scores = {empCpd['interim_id']: empCpd['cpd_scores'] 
+                      for empCpd in self.DictOfEmpiricalCompounds.values()}
+        EmpCpd_index, cpd_index = {}, {}
+        feature_EmpCpd_index = {}
+        indptr, indices = [0], []
+        features = self.features + [f for f in self.feature_to_EmpiricalCompound 
+                                    if f not in self.data.FeatureTable.index]
+        for f in features:
+            E = self.feature_to_EmpiricalCompound.get(f, None)
+            if E and cpd_scores.get(E):
+                if E not in EmpCpd_index:
+                    EmpCpd_index[E] = len(EmpCpd_index)
+                    for cpd in cpd_scores[E]:
+                        if cpd not in cpd_index:
+                            cpd_index[cpd] = len(cpd_index)
+                        indices.append(cpd_index[cpd])
+                    indptr.append(len(indices))
+                feature_EmpCpd_index[f] = EmpCpd_index[E]
+        
+        self.EmpCpd_ids, self.cpd_ids = list(EmpCpd_index), list(cpd_index)
+        self.feature_EmpCpd_index = feature_EmpCpd_index
+        self.feature_EmpCpd = np.array([feature_EmpCpd_index.get(f, -1) for f in self.features], 
+                                       dtype=np.int64)
+        self.EmpCpd_cpd_indptr = np.array(indptr, dtype=np.int64)
+        self.EmpCpd_cpd_indices = np.array(indices, dtype=np.int64)
+
+
+    def expand_EmpCpd_Cpd(self, EmpCpds):
+        '''
+        Given an array of EmpCpd indices (-1 for none), e.g. self.feature_EmpCpd[rows],
+        get positions, EmpCpd and cpd indices of all (EmpCpd, cpd) pairs, by position then cpd order.
+        
+        Return:
+            positions in EmpCpds, EmpCpd indices, cpd indices; np.arrays of equal length
+        '''
+        positions = np.nonzero(EmpCpds >= 0)[0]
+        EmpCpds = EmpCpds[positions]
+        starts = self.EmpCpd_cpd_indptr[EmpCpds]
+        counts = self.EmpCpd_cpd_indptr[EmpCpds + 1] - starts
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cpds = self.EmpCpd_cpd_indices[np.repeat(starts, counts) + offsets]
+        return np.repeat(positions, counts), np.repeat(EmpCpds, counts), cpds
+
+    
     def batch_rowindex_EmpCpd_Cpd(self, list_features):
         
         
         '''
         Batch matching from row feature to Ecpds; Use trio data structure, (M.row_number, EmpiricalCompounds, Cpd).
         Will be used to map for both sig list and permutation lists.
+        Trios are made from the integer index (see index_EmpCpd_Cpd_arrays, expand_EmpCpd_Cpd).
         '''
-        new = []
-        for f in list_features:
-            E = self.feature_to_EmpiricalCompound.get(f, None)
-            if E:
-                for cpd, score in self.DictOfEmpiricalCompounds[E]['cpd_scores'].items():
-                    new.append((f, E, cpd))
-            
-        return new
+        positions, EmpCpds, cpds = self.expand_EmpCpd_Cpd(
+            np.array([self.feature_EmpCpd_index.get(f, -1) for f in list_features], dtype=np.int64))
+        EmpCpd_ids, cpd_ids = self.EmpCpd_ids, self.cpd_ids
+        return [(list_features[ii], EmpCpd_ids[E], cpd_ids[c]) for ii, E, c in 
+                zip(positions.tolist(), EmpCpds.tolist(), cpds.tolist())]
+    
+    
+    
+    def reference_digest(self):
+        '''
+        Hash of reference features and their (EmpiricalCompound, cpds) in Trio order,
+        as key of cached permutation records. Computed once.
+        '''
+        if getattr(self, '_reference_digest', None) is None:
+            cpd_scores = {empCpd['interim_id']: empCpd['cpd_scores'] 
+                          for empCpd in self.DictOfEmpiricalCompounds.values()}
+            def _items():
+                for f in self.features:
+                    yield f
+                    E = self.feature_to_EmpiricalCompound.get(f, None)
+                    if E:
+                        yield E
+                        yield list(cpd_scores.get(E, {}))
+            self._reference_digest = digest(_items())
+        return self._reference_digest
     
     
+    def get_feature_EmpCpd_matrix(self):
+        '''
+        Sparse incidence matrix from reference features (self.features, rows)
+        to EmpiricalCompounds that have candidate cpds (columns).
+        Same mapping as batch_rowindex_EmpCpd_Cpd, as EmpCpds without cpds produce no Trios.
+        
+        Return:
+            scipy.sparse.csr_matrix of shape (len(self.features), number of EmpCpds), 
+            [EmpiricalCompound IDs, ...] for the columns
+        '''
+        rows = np.nonzero(self.feature_EmpCpd >= 0)[0]
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, self.feature_EmpCpd[rows])), 
+                                   shape=(len(self.features), len(self.EmpCpd_ids)))
+        return matrix, self.EmpCpd_ids
+    
     
     def to_json(self):
         '''
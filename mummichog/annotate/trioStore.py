@@ -0,0 +1,145 @@
+'''
+Compact store of Trios, (feature, EmpiricalCompound, cpd),
+the mapping of features to EmpiricalCompounds to candidate compounds used in all analyses.
+
+Trios are kept as three parallel int32 arrays of codes into ID tables (one per column),
+instead of a list of string tuples, as every feature of an EmpiricalCompound is repeated
+for every candidate cpd. Group-by indexes per feature, EmpiricalCompound and cpd are built on first use.
+
+Iterating a TrioStore gives the (feature, EmpiricalCompound, cpd) tuples of IDs,
+so that it can be used where a TrioList is expected:
+    >>> T = TrioStore.from_tuples([('F1', 'E1', 'C1'), ('F2', 'E1', 'C1'), ('F3', 'E2', 'C2')])
+    >>> list(T.select(T.isin('cpd', {'C1'})))
+    [('F1', 'E1', 'C1'), ('F2', 'E1', 'C1')]
+'''
+
+import numpy as np
+
+COLUMNS = ('feature', 'EmpCpd', 'cpd')
+
+
+class TrioStore:
+    '''
+    Trios as codes: self.codes[column] is an int32 array, self.ids[column] the list of IDs by code.
+    '''
+    def __init__(self, feature_ids, EmpCpd_ids, cpd_ids, features, EmpCpds, cpds):
+        self.ids = {'feature': feature_ids, 'EmpCpd': EmpCpd_ids, 'cpd': cpd_ids}
+        self.codes = {'feature': np.asarray(features, dtype=np.int32),
+                      'EmpCpd': np.asarray(EmpCpds, dtype=np.int32),
+                      'cpd': np.asarray(cpds, dtype=np.int32)}
+        self.__groups = {}
+        self.__lookup = {}
+
+    @classmethod
+    def from_EmpiricalCompounds(cls, list_empCpds):
+        '''
+        Trios of empirical compounds in order, for each cpd in cpd_scores, each feature in MS1_pseudo_Spectra,
+        same order as the TrioList of DataMeetModel.index_EmpCpd_Cpd.
+        '''
+        tables = ({}, {}, {})
+        features, EmpCpds, cpds = [], [], []
+        def _code(table, x):
+            if x not in table:
+                table[x] = len(table)
+            return table[x]
+
+        for empCpd in list_empCpds:
+            if not empCpd['cpd_scores']:
+                continue
+            fcodes = [_code(tables[0], feat['id']) for feat in empCpd['MS1_pseudo_Spectra']]
+            ccodes = [_code(tables[2], cpd) for cpd in empCpd['cpd_scores']]
+            e, k = _code(tables[1], empCpd['interim_id']), len(fcodes)
+            features += fcodes * len(ccodes)
+            EmpCpds += [e] * (k * len(ccodes))
+            for c in ccodes:
+                cpds += [c] * k
+        return cls(list(tables[0]), list(tables[1]), list(tables[2]), features, EmpCpds, cpds)
+
+    @classmethod
+    def from_tuples(cls, trios):
+        '''
+        Store of a list of (feature, EmpCpd, cpd) tuples.
+        '''
+        tables = ({}, {}, {})
+        codes = [[tables[ii].setdefault(T[ii], len(tables[ii])) for T in trios] for ii in range(3)]
+        return cls(*[list(t) for t in tables], *codes)
+
+    def __len__(self):
+        return self.codes['feature'].size
+
+    def __iter__(self):
+        F, E, C = self.ids['feature'], self.ids['EmpCpd'], self.ids['cpd']
+        for f, e, c in zip(self.codes['feature'].tolist(), self.codes['EmpCpd'].tolist(),
+                           self.codes['cpd'].tolist()):
+            yield (F[f], E[e], C[c])
+
+    def __getitem__(self, ii):
+        return tuple(self.ids[col][self.codes[col][ii]] for col in COLUMNS)
+
+    def column(self, column):
+        '''
+        IDs of a column, one per Trio, e.g. column('cpd') for seed cpds.
+        '''
+        ids = self.ids[column]
+        return [ids[x] for x in self.codes[column].tolist()]
+
+    def unique(self, column):
+        '''
+        IDs present in a column, in order of code (first appearance).
+        '''
+        ids = self.ids[column]
+        return [ids[x] for x in np.unique(self.codes[column]).tolist()]
+
+    def group_index(self, column):
+        '''
+        Group-by index of a column, built once, as CSR arrays:
+        Trio positions of code x are order[indptr[x]:indptr[x+1]], in Trio order.
+        '''
+        if column not in self.__groups:
+            codes = self.codes[column]
+            order = np.argsort(codes, kind='stable')
+            indptr = np.zeros(len(self.ids[column]) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum(np.bincount(codes, minlength=len(self.ids[column])))
+            self.__groups[column] = (indptr, order)
+        return self.__groups[column]
+
+    def positions(self, column, id):
+        '''
+        Trio positions of an ID in a column, by the group-by index.
+        '''
+        if column not in self.__lookup:
+            self.__lookup[column] = dict(zip(self.ids[column], range(len(self.ids[column]))))
+        x = self.__lookup[column].get(id)
+        if x is None:
+            return np.empty(0, dtype=np.int64)
+        indptr, order = self.group_index(column)
+        return order[indptr[x]:indptr[x+1]]
+
+    def isin(self, column, ids):
+        '''
+        Boolean mask of Trios whose ID in column is in ids, by the group-by index of column.
+        '''
+        mask = np.zeros(len(self), dtype=bool)
+        for x in ids:
+            mask[self.positions(column, x)] = True
+        return mask
+
+    def select(self, mask):
+        '''
+        TrioStore of the Trios in boolean mask or positions, sharing ID tables.
+        '''
+        return TrioStore(self.ids['feature'], self.ids['EmpCpd'], self.ids['cpd'],
+                         *[self.codes[col][mask] for col in COLUMNS])
+
+    def cpd_EmpCpds(self):
+        '''
+        {cpd: set of EmpiricalCompounds}, over all Trios, by the group-by index of cpd
+        '''
+        E, C = self.ids['EmpCpd'], self.ids['cpd']
+        indptr, order = self.group_index('cpd')
+        indptr, EmpCpds = indptr.tolist(), self.codes['EmpCpd'][order].tolist()
+        result = {}
+        for c in range(len(C)):
+            if indptr[c] < indptr[c+1]:
+                result[C[c]] = set([E[e] for e in EmpCpds[indptr[c]:indptr[c+1]]])
+        return result
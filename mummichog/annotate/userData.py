@@ -3,9 +3,14 @@
     
 '''
 
-import json
 import os
 import logging
+import numpy as np
+
+from .featureTable import FeatureTable
+from .empCpdStream import load_empCpds
+from ..stageTrace import stage
+
 MASS_RANGE = (50, 2000)
 RETENTION_TIME_TOLERANCE_FRAC = 0.02    
 
@@ -27,32 +32,54 @@ class InputUserData:
         self.web = web
         self.paradict = paradict
         self.header_fields = []
-        self.ListOfUserFeatures = []
+        self.FeatureTable = None
         self.input_featurelist = []
 
         # entry point of data input
         self.read()
         self.update()
         
+    @classmethod
+    def from_feature_table(cls, paradict, feature_table, EmpiricalCompounds):
+        '''
+        InputUserData on a parsed FeatureTable and loaded EmpiricalCompounds,
+        without reading files, e.g. for contrasts sharing one feature table in batch mode.
+        The significant list is determined by paradict['cutoff'] on feature_table.pval.
+        '''
+        D = cls.__new__(cls)
+        D.web = False
+        D.paradict = paradict
+        D.header_fields = []
+        D.FeatureTable = feature_table
+        D.input_featurelist = []
+        D.update_features()
+        D.EmpiricalCompounds = EmpiricalCompounds
+        return D
+        
+    def update_features(self):
+        '''
+        Update max retention time and m/z, and is_significant to all features
+        '''
+        self.max_retention_time = float(self.FeatureTable.rtime.max())
+        self.max_mz = float(self.FeatureTable.mz.max())
+        self.determine_significant_list(self.FeatureTable)
+        
     def update(self):
         '''
         Update retention_time_rank and is_significant to all MassFeatures
         
-        Get user supplied JSON annotation if provided.
+        Get user supplied JSON annotation if provided,
+        as .json, .json.gz or .json.zip, loaded by streaming (see empCpdStream.py).
         
         '''
-        retention_times = [M['rtime'] for M in self.ListOfUserFeatures]
-        self.max_retention_time = max(retention_times)
-
-        self.max_mz = max([M['mz'] for M in self.ListOfUserFeatures])
-        self.determine_significant_list(self.ListOfUserFeatures)
+        self.update_features()
         
         if 'annotation' in self.paradict and self.paradict['annotation']:
             # load empirical compound annotation from JSON file
             empCpd_json_file = os.path.join(self.paradict['workdir'], self.paradict['annotation'])
-            with open(empCpd_json_file) as f:
-                empCpd_json_text = f.read()
-            self.EmpiricalCompounds = json.loads(empCpd_json_text)
+            with stage('load_empCpds') as r:
+                self.EmpiricalCompounds = load_empCpds(empCpd_json_file)
+                r['EmpiricalCompounds'] = len(self.EmpiricalCompounds)
             
             print("Loaded %d empirical compounds from annotation file." %len(self.EmpiricalCompounds))
             
@@ -60,48 +87,26 @@ class InputUserData:
             self.EmpiricalCompounds = {}
         
         
+    @property
+    def ListOfUserFeatures(self):
+        '''
+        Features in dict format, made on demand from self.FeatureTable.
+        '''
+        return self.FeatureTable.to_dicts()
+
     def text_to_ListOfUserFeatures(self, textValue, delimiter='\t'):
         '''
         Column order is hard coded for now, as mz, retention_time, p_value, statistic, CompoundID_from_user
 
-        use asari style JSON features
+        use asari style JSON features, stored in columns as self.FeatureTable
 
         '''
-        def _make_id(ii, mz, rt):
-            return 'F' + str(ii) + '_' + str(round(mz, 6)) + '@' + str(round(rt, 2))
-        #
         lines = self.__check_redundant__( textValue.splitlines() )
         self.header_fields = lines[0].rstrip().split(delimiter)
-
-        excluded_list = []
-        for ii in range(len( lines )-1):
-            y = lines[ii+1].split('\t')
-            
-            fid_from_user = ''
-            if len(y) > 4: fid_from_user = y[4].strip()
-
-            [mz, rtime, p_value, statistic] = [float(x) for x in y[:4]]
-            
-            # row_number, mz, retention_time, p_value, statistic, CompoundID_from_user
-            if MASS_RANGE[0] < mz < MASS_RANGE[1]:
-                # row # human-friendly, numbering from 1
-                fid = _make_id(ii+1, mz, rtime)
-                peak = {'id_number': fid, 
-                        'id': fid,
-                        'fid_from_user': fid_from_user or fid,
-                        'mz': mz, 
-                        'rtime': rtime,
-                        'pval': p_value,
-                        'statistic': statistic,
-                        }
-                self.ListOfUserFeatures.append( 
-                    peak
-                    )
-            else:
-                excluded_list.append( (ii, mz, rtime) )
+        self.FeatureTable = FeatureTable.from_text(lines, delimiter, MASS_RANGE)
         
-        if excluded_list:
-            print( "Excluding %d features out of m/z range %s." %(len(excluded_list), str(MASS_RANGE)) )
+        if self.FeatureTable.excluded:
+            print( "Excluding %d features out of m/z range %s." %(len(self.FeatureTable.excluded), str(MASS_RANGE)) )
 
         
     def read_from_file(self, inputFile):
@@ -122,31 +127,35 @@ class InputUserData:
         Row_numbers (rowii+1) are used as primary ID.
         # not using readlines() to avoid problem in processing some Mac files
         '''
-        if self.web:
-            self.text_to_ListOfUserFeatures(self.paradict['datatext'])
-        else:
-            self.text_to_ListOfUserFeatures( 
-                open(os.path.join(self.paradict['workdir'], self.paradict['infile'])).read() )
+        with stage('InputUserData.read') as r:
+            if self.web:
+                self.text_to_ListOfUserFeatures(self.paradict['datatext'])
+            else:
+                self.text_to_ListOfUserFeatures( 
+                    open(os.path.join(self.paradict['workdir'], self.paradict['infile'])).read() )
+            r['features'] = len(self.FeatureTable)
 
-        print("Read %d features as reference list." %len(self.ListOfUserFeatures))
+        print("Read %d features as reference list." %len(self.FeatureTable))
     
     
     # more work?
-    def determine_significant_list(self, all_feature_list):
+    def determine_significant_list(self, feature_table):
         '''
         For single input file format in ver 2. 
         The significant list, input_mzlist, should be a subset of ref_mzlist,
         determined either by user specificed --cutoff,
         or by automated cutoff close to a p-value hotspot,
         in which case, paradict['cutoff'] is updated accordingly.
+        Counts and the significance mask are computed on feature_table.pval.
 
         '''
         if not self.paradict['cutoff']:
             # automated cutoff
-            new = sorted(all_feature_list, key=lambda x: x['pval'])
+            new = np.sort(feature_table.pval)
             
             p_hotspots = [ 0.2, 0.1, 0.05, 0.01, 0.005, 0.001, 0.0001 ]
-            N_hotspots = [ len([x for x in all_feature_list if x['pval'] < pp]) for pp in p_hotspots ]
+            # number of features with p < pp
+            N_hotspots = np.searchsorted(new, p_hotspots, side='left').tolist()
             
             N_quantile = len(new) / 4
             N_optimum, N_minimum = 300, 30
@@ -164,7 +173,7 @@ class InputUserData:
             
             if chosen > 100:
                 N_chosen = int(N_quantile)
-                self.paradict['cutoff'] = new[N_chosen+1]['pval']
+                self.paradict['cutoff'] = float(new[N_chosen+1])
             else:
                 #N_chosen = N_hotspots[chosen]
                 
@@ -173,13 +182,8 @@ class InputUserData:
             print("Automatically choosing (p < %f) as significant cutoff."  %self.paradict['cutoff'])  
         
         # mark MassFeature significant
-        for f in self.ListOfUserFeatures:
-            if f['pval'] < self.paradict['cutoff']:
-                f['is_significant'] = True
-            else:
-                f['is_significant'] = False
+        feature_table.is_significant = feature_table.pval < self.paradict['cutoff']
         
-        self.input_featurelist = [f['fid_from_user'] for f in self.ListOfUserFeatures if f['is_significant']]
+        self.input_featurelist = feature_table.fid_from_user[feature_table.is_significant].tolist()
         print("Using %d features (p < %f) as significant list." 
-                              %(len(self.input_featurelist), self.paradict['cutoff']))  
-
+                              %(len(self.input_featurelist), self.paradict['cutoff']))
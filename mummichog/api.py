@@ -1,12 +1,32 @@
 '''
 Local API for mummichog
+
+Names are imported on first use (PEP 562 module __getattr__),
+as numpy, scipy and networkx take most of the start time of the command line.
 '''
 
+import importlib
+
+# name: module it is imported from
+_API = {
+    'InputUserData': '.annotate.userData',
+    'DataMeetModel': '.annotate.meetModel',
+    'PathwayAnalysis': '.algorithms.pathwayAnalysis',
+    'ModularAnalysis': '.algorithms.modularAnalysis',
+    'ActivityNetwork': '.algorithms.activityNetwork',
+    'json_export_all': '.report.reporting',
+}
+
+__all__ = list(_API)
+
+
+def __getattr__(name):
+    if name not in _API:
+        raise AttributeError("module %r has no attribute %r" %(__name__, name))
+    value = getattr(importlib.import_module(_API[name], __package__), name)
+    globals()[name] = value
+    return value
 
-from .annotate.userData import InputUserData
-from .annotate.meetModel import DataMeetModel
-from .algorithms.pathwayAnalysis import PathwayAnalysis
-from .algorithms.modularAnalysis import ModularAnalysis
-from .algorithms.activityNetwork import ActivityNetwork
 
-from .report.reporting import json_export_all
+def __dir__():
+    return sorted(set(globals()) | set(_API))
@@ -0,0 +1,258 @@
+# Licensed under the BSD 3-Clause License.
+#
+# mummichog - pathway and network analysis for metabolomics
+#
+
+'''
+Batch mode: multiple contrasts (p-value and statistic columns) on the same features,
+sharing one metabolic model and one DataMeetModel mapping of features -> EmpiricalCompounds -> cpds.
+
+The metabolic model is loaded once; the feature table and annotation are parsed and mapped once
+per distinct set of features, then pathway, module and activity network analyses run per contrast.
+Output per contrast is the same as a separate mummichog run on a table of
+mz, retention_time, p_value, statistic[, CompoundID_from_user] of that contrast,
+written as mcg_output_{contrast}.json (.json.gz with --gzip) in the output directory.
+
+Contrasts are given as either
+    one table with multiple p-value/statistic columns, by header name or column index (from 0):
+        mummichog-batch -d workdir -i table.tsv -a empCpds.json --contrasts KO=p_KO:t_KO WT=p_WT:t_WT
+    or a manifest of tables in the default column order, one contrast per line, tab delimited:
+        name    infile
+        KO      ko_ttest.tsv
+        WT      wt_ttest.tsv
+    run as
+        mummichog-batch -d workdir --manifest manifest.tsv -a empCpds.json
+    Tables in a manifest that have the same features share their mapping.
+'''
+
+import os
+import copy
+import time
+import argparse
+
+from mummichog import __version__
+
+from .report.reporting import write_json_sections
+from .main import add_analysis_arguments, run_analyses, json_output_path
+from .parameters import PARAMETERS
+from .stageTrace import stage, start_trace, finish_trace
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='mummichog v%s batch mode: multiple contrasts sharing one model and mapping' %__version__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('-v', '--version', action='version', version=__version__,
+            help='print version and exit')
+    parser.add_argument('-i', '--infile', type=str,
+            help='input table with multiple p-value and statistic columns')
+    parser.add_argument('--contrasts', type=str, nargs='+',
+            help='contrasts in infile as [name=]pvalue_column:statistic_column, by header name or index')
+    parser.add_argument('--mz_column', type=str, default='0',
+            help='m/z column in infile, by header name or index')
+    parser.add_argument('--rtime_column', type=str, default='1',
+            help='retention time column in infile, by header name or index')
+    parser.add_argument('--id_column', type=str,
+            help='CompoundID_from_user column in infile, by header name or index')
+    parser.add_argument('--manifest', type=str,
+            help='tab delimited file of contrast name and input file per line, instead of infile')
+    add_analysis_arguments(parser)
+
+    args = parser.parse_args()
+    return args
+
+
+def column_index(header_fields, column):
+    '''
+    Index of column, given by header name or as index string
+    '''
+    if column in header_fields:
+        return header_fields.index(column)
+    try:
+        return int(column)
+    except ValueError:
+        raise ValueError("Column %s is not found in header %s." %(column, str(header_fields)))
+
+
+def parse_contrasts(header_fields, contrasts):
+    '''
+    Parse contrast specifications as [name=]pvalue_column:statistic_column.
+
+    Return:
+        [(name, pvalue column index, statistic column index), ...]
+    '''
+    new = []
+    for spec in contrasts:
+        name, _, columns = spec.rpartition('=')
+        try:
+            pcol, scol = columns.split(':')
+        except ValueError:
+            raise ValueError("Contrast %s is not in format [name=]pvalue_column:statistic_column." %spec)
+        new.append((name or pcol, column_index(header_fields, pcol), column_index(header_fields, scol)))
+    names = [x[0] for x in new]
+    if len(set(names)) < len(names):
+        raise ValueError("Contrast names are not unique: %s." %str(names))
+    return new
+
+
+def read_multicontrast_table(textValue, contrasts, mz_column='0', rtime_column='1', id_column=None,
+                             delimiter='\t'):
+    '''
+    Parse a table of multiple contrasts once.
+
+    Return:
+        {contrast name: FeatureTable, ...}, all sharing feature IDs, mz and rtime arrays
+    '''
+    import numpy as np
+    from .annotate.featureTable import FeatureTable
+    from .annotate.userData import MASS_RANGE
+
+    lines = textValue.splitlines()
+    header_fields = lines[0].rstrip().split(delimiter)
+    specs = parse_contrasts(header_fields, contrasts)
+    columns = (column_index(header_fields, mz_column), column_index(header_fields, rtime_column))
+    if id_column is not None:
+        id_column = column_index(header_fields, id_column)
+
+    name, pcol, scol = specs[0]
+    base = FeatureTable.from_text(lines, delimiter, MASS_RANGE, columns + (pcol, scol), id_column)
+    if base.excluded:
+        print( "Excluding %d features out of m/z range %s." %(len(base.excluded), str(MASS_RANGE)) )
+    tables = {name: base}
+    if len(specs) > 1:
+        usecols = [c for x in specs[1:] for c in x[1:]]
+        values = np.loadtxt(lines[1:], delimiter=delimiter, usecols=usecols,
+                            dtype=np.float64, ndmin=2, comments=None)[base.row_numbers - 1]
+        for ii, (name, pcol, scol) in enumerate(specs[1:]):
+            tables[name] = base.with_values(values[:, 2*ii], values[:, 2*ii + 1])
+    return tables
+
+
+def read_manifest(path, workdir=''):
+    '''
+    Read manifest of contrast name and input file per line; lines starting with # are skipped,
+    as is a header line 'name  infile'.
+
+    Return:
+        {contrast name: FeatureTable, ...}
+    '''
+    from .annotate.featureTable import FeatureTable
+    from .annotate.userData import MASS_RANGE
+
+    tables = {}
+    for line in open(path).read().splitlines():
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        if len(fields) < 2:
+            raise ValueError("Manifest line is not 'name<TAB>infile': %s" %line)
+        name, infile = fields[0].strip(), fields[1].strip()
+        if (name, infile) == ('name', 'infile'):
+            continue
+        if name in tables:
+            raise ValueError("Contrast %s is repeated in manifest." %name)
+        lines = open(os.path.join(workdir, infile)).read().splitlines()
+        tables[name] = FeatureTable.from_text(lines, '\t', MASS_RANGE)
+        print("Read %d features for contrast %s from %s." %(len(tables[name]), name, infile))
+    return tables
+
+
+def run_batch(parameters, tables, theoreticalModel=None):
+    '''
+    Run mummichog on each contrast, sharing metabolic model, annotation and DataMeetModel indexes
+    among contrasts of the same features.
+
+    Input:
+        parameters as in main(); cutoff applies to each contrast, automated if None.
+        tables, {contrast name: FeatureTable, ...}.
+    Return:
+        {contrast name: output of json_export_all, ...}, in order of tables
+    '''
+    from mummichog.models.get_models import get_metabolic_model
+    from .api import InputUserData, DataMeetModel, json_export_all
+    from .annotate.empCpdStream import load_empCpds
+
+    if theoreticalModel is None:
+        theoreticalModel = get_metabolic_model( parameters['network'] )
+    EmpiricalCompounds = {}
+    if parameters.get('annotation'):
+        with stage('load_empCpds') as r:
+            EmpiricalCompounds = load_empCpds(os.path.join(parameters.get('workdir', ''), parameters['annotation']))
+            r['EmpiricalCompounds'] = len(EmpiricalCompounds)
+        print("Loaded %d empirical compounds from annotation file." %len(EmpiricalCompounds))
+
+    # DataMeetModel per distinct feature table, as [(FeatureTable, DataMeetModel), ...]
+    mapped = []
+    results = {}
+    for name, table in tables.items():
+        print("\n~~~~~~ Contrast %s ~~~~~~\n" %name)
+        # stages of the contrast are recorded as its children in the trace
+        with stage('contrast') as r:
+            r['contrast'] = name
+            paradict = parameters.copy()
+            userData = InputUserData.from_feature_table(paradict, table, EmpiricalCompounds)
+            for T, M in mapped:
+                if T.ids is table.ids or T.ids.tolist() == table.ids.tolist():
+                    mixedNetwork = M.for_contrast(userData)
+                    break
+            else:
+                # DataMeetModel updates EmpiricalCompounds in place, thus a fresh copy per mapping
+                userData.EmpiricalCompounds = copy.deepcopy(EmpiricalCompounds)
+                mixedNetwork = DataMeetModel(theoreticalModel, userData)
+                mapped.append((table, mixedNetwork))
+
+            PA, MA, AN = run_analyses(mixedNetwork)
+            with stage('json_export'):
+                results[name] = json_export_all(mixedNetwork, PA, MA, AN)
+
+    return results
+
+
+def main():
+
+    print ( "mummichog version %s, batch mode \n" %__version__ )
+
+    # make a copy of the default parameters; user options will override
+    parameters = PARAMETERS.copy()
+    args = build_parser()
+    for k, v in vars(args).items():
+        if v is not None:
+            parameters[k] = v
+    workdir = parameters.get('workdir', '') or ''
+
+    print("Started @ %s\n" %time.asctime())
+    start_trace(parameters)
+    # the trace is written also if a stage fails or the run is interrupted
+    try:
+        with stage('read_tables') as r:
+            if args.manifest:
+                tables = read_manifest(os.path.join(workdir, args.manifest), workdir)
+            elif args.infile and args.contrasts:
+                tables = read_multicontrast_table(open(os.path.join(workdir, args.infile)).read(),
+                                    args.contrasts, args.mz_column, args.rtime_column, args.id_column)
+            else:
+                raise SystemExit("Batch mode needs --manifest, or --infile with --contrasts.")
+            r['contrasts'] = len(tables)
+
+        results = run_batch(parameters, tables)
+
+        print("\nFinished @ %s\n" %time.asctime())
+        for name, MCG_JSON in results.items():
+            outfile = json_output_path(parameters, name)
+            write_json_sections(MCG_JSON, outfile)
+            print("JSON output of contrast %s was written in %s." %(name, outfile))
+    finally:
+        trace_file = finish_trace()
+        if trace_file:
+            print("Stage trace was written in %s." %trace_file)
+
+
+
+#
+# -----------------------------------------------------------------------------
+#
+
+if __name__ == '__main__':
+
+    main()
@@ -1 +1,16 @@
+import sys
+
 from mummichog.main import *
+from mummichog.main import main as run_main
+
+
+def main():
+    '''
+    mummichog [options], or
+    mummichog serve [options] for the local analysis server (see server.py)
+    '''
+    if sys.argv[1:2] == ['serve']:
+        from mummichog.server import main as serve
+        serve(sys.argv[2:])
+    else:
+        run_main()
@@ -3,15 +3,14 @@
 # mummichog - pathway and network analysis for metabolomics
 #
 
+import os
 import time
 import argparse
 import sys
-import json
 from mummichog import __version__
-from mummichog.models.get_models import get_metabolic_model
 
-from .api import *
 from .parameters import PARAMETERS
+from .stageTrace import stage, start_trace, finish_trace
 
 fishlogo = '''     
     --------------------------------------------
@@ -36,16 +35,30 @@ def build_parser():
     # add arguments
     parser.add_argument('-v', '--version', action='version', version=__version__, 
             help='print version and exit')
+    parser.add_argument('-i', '--infile', type=str,
+            help='input file with statistical results')
+    parser.add_argument('--json_output', type=str,
+            help='JSON result file (default mcg_output.json), in the output directory if relative; .gz to compress')
+    add_analysis_arguments(parser)
+    
+    args = parser.parse_args()
+    return args
+
+
+def add_analysis_arguments(parser):
+    '''
+    Arguments shared by main() and batch mode
+    '''
     parser.add_argument('-j', '--project', type=str,
             help='project name')
+    parser.add_argument('-n', '--network', type=str,
+            help='metabolic model, by name or path to JSON model file')
     parser.add_argument('-m', '--mode', type=str,
-            help='mode of ionization, pos or neg')
+            help='mode of ionization, pos or neg, or an adduct table in parameters.ADDUCT_TABLES, e.g. pos_primary')
     parser.add_argument('--ppm', type=int, 
             help='mass precision in ppm (part per million), same as mz_tolerance_ppm')
     parser.add_argument('-d', '--workdir', type=str,
             help='working directory')
-    parser.add_argument('-i', '--infile', type=str,
-            help='input file with statistical results')
     parser.add_argument('-a', '--annotation', type=str,
             help='annotation file in empirical compound format (json)')
     parser.add_argument('-o', '--output', type=str,
@@ -55,9 +68,73 @@ def build_parser():
 
     parser.add_argument('-p', '--permutation', type=int,
             help='number of permutations to estimate null distributions')
+    parser.add_argument('--permutation_engine', type=str, choices=['trio', 'sparse'],
+            help='pathway permutations by EmpCpd bitsets of trios or by sparse matrix products')
+    parser.add_argument('--permutation_mode', type=str, choices=['fixed', 'adaptive'],
+            help='fixed number of pathway permutations, or adaptive, stopping early per pathway (max is --permutation)')
+    parser.add_argument('--permutation_error', type=float,
+            help='relative error of p-values in adaptive permutations')
+    parser.add_argument('--jobs', type=int,
+            help='number of processes for module permutations')
+    parser.add_argument('--seed', type=int,
+            help='random seed of permutations, for reproducible results; drawn per run if not given')
+    parser.add_argument('--null_cache_dir', type=cache_dir_argument,
+            help='directory to cache permutation records, reused in runs with the same --seed; '
+                 'false to disable, same as --null_cache_size 0')
+    parser.add_argument('--null_cache_size', type=int,
+            help='size limit of permutation cache in MB, 0 to disable')
+    parser.add_argument('--gzip', action='store_true', default=None,
+            help='gzip compress JSON results')
+    parser.add_argument('--trace', type=str,
+            help='write wall/CPU time, memory and item counts of each stage to this JSON file')
+    parser.add_argument('--profile', action='store_true', default=None,
+            help='profile each stage by cProfile, to .prof files next to the trace file (default mcg_trace.json)')
+
+
+def cache_dir_argument(value):
+    '''
+    --null_cache_dir value; 'false' or 'none' (any case) disable the cache, as null_cache_dir = False
+    '''
+    if value.lower() in ('false', 'none'):
+        return False
+    return value
+
+
+def run_analyses(mixedNetwork):
+    '''
+    Pathway, module and activity network analyses on a DataMeetModel instance.
     
-    args = parser.parse_args()
-    return args
+    Return:
+        PathwayAnalysis, ModularAnalysis and ActivityNetwork instances
+    '''
+    from .api import PathwayAnalysis, ModularAnalysis, ActivityNetwork
+
+    # getting a list of Pathway instances, with p-values, in PA.resultListOfPathways
+    PA = PathwayAnalysis(mixedNetwork.model.metabolic_pathways, mixedNetwork)
+    PA.cpd_enrich_test()
+    
+    # Module analysis, getting a list of Mmodule instances
+    MA = ModularAnalysis(mixedNetwork)
+    MA.dispatch()
+    
+    # do activity network
+    AN = ActivityNetwork( mixedNetwork, set(PA.collect_hit_Trios() + MA.collect_hit_Trios()) )
+    return PA, MA, AN
+
+
+def json_output_path(parameters, name=None):
+    '''
+    Path of JSON result file, parameters['json_output'] or mcg_output_{name}.json,
+    under parameters['output'] directory unless an absolute path;
+    with .gz added if parameters['gzip']. The directory of the file is created if needed.
+    '''
+    outfile = 'mcg_output_%s.json' %name if name else parameters.get('json_output') or 'mcg_output.json'
+    if parameters.get('gzip') and not outfile.endswith('.gz'):
+        outfile += '.gz'
+    path = os.path.join(parameters.get('output') or '', outfile)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
 
 
 def main():
@@ -74,48 +151,45 @@ def main():
         if v is not None:           # update only those provided by user, not None
             parameters[k] = v
 
+    # heavy imports (numpy, scipy, networkx) after arguments are parsed
+    from mummichog.models.get_models import get_metabolic_model
+    from .api import InputUserData, DataMeetModel
+    from .report.reporting import json_export_sections, write_json_sections
+
     print("Started @ %s\n" %time.asctime())
-    userData = InputUserData(parameters)
-    theoreticalModel = get_metabolic_model( parameters['network'] )
-    
-    # for developer testing
-    print(
-            list(theoreticalModel.Compounds.items())[92], "...\n"
-    )
-    print(parameters)
+    start_trace(parameters)
+    # the trace is written also if a stage fails or the run is interrupted
+    try:
+        userData = InputUserData(parameters)
+        theoreticalModel = get_metabolic_model( parameters['network'] )
     
-    mixedNetwork = DataMeetModel(theoreticalModel, userData)
+        # for developer testing
+        print(
+                list(theoreticalModel.Compounds.items())[92], "...\n"
+        )
+        print(parameters)
     
+        mixedNetwork = DataMeetModel(theoreticalModel, userData)
     
-    # getting a list of Pathway instances, with p-values, in PA.resultListOfPathways
-    PA = PathwayAnalysis(mixedNetwork.model.metabolic_pathways, mixedNetwork)
-    PA.cpd_enrich_test()
-    
-    # Module analysis, getting a list of Mmodule instances
-    MA = ModularAnalysis(mixedNetwork)
-    MA.dispatch()
-    
-    # do activity network
-    AN = ActivityNetwork( mixedNetwork, set(PA.collect_hit_Trios() + MA.collect_hit_Trios()) )
-
-
-    print("\nFinished @ %s\n" %time.asctime())
+        PA, MA, AN = run_analyses(mixedNetwork)
 
-    #
-    #  This is to export data as Python objects
-    #
-    MCG_JSON = json_export_all(mixedNetwork, PA, MA, AN)
 
-    #print(MCG_JSON)
-    print("\n\n~~~~~~~~~~~~~~~~~~~~\n\n")
+        print("\nFinished @ %s\n" %time.asctime())
 
-    # Use Encoder to convert Python to JSON format 
-    s = json.JSONEncoder().encode(MCG_JSON )
-    with open("mcg_output.json", "w") as O:
-        O.write(s)
+        #
+        #  This is to export data as Python objects
+        #
+        print("\n\n~~~~~~~~~~~~~~~~~~~~\n\n")
+        outfile = json_output_path(parameters)
+        with stage('json_export') as r:
+            # sections are encoded to file one at a time, in chunks, not as one string
+            r['bytes'] = write_json_sections(json_export_sections(mixedNetwork, PA, MA, AN), outfile)
 
-    #print(json.dumps(s,  indent=4) [:500])
-    print("JSON output was written in mcg_output.json.")
+        print("JSON output was written in %s." %outfile)
+    finally:
+        trace_file = finish_trace()
+        if trace_file:
+            print("Stage trace was written in %s." %trace_file)
 
   
 
@@ -1,7 +1,7 @@
 '''
 metabolic models from
 a. Python import here (metabolicModels.py)
-b. JSON files here under json/
+b. JSON files here under json/, converted by json_models.py
 c. external database JMS/Azimuth DB (future)
 
 from jms.modelConvert import convert_json_model
@@ -50,9 +50,23 @@ dict_keys(['human_model_mfn', 'worm_model_icel1273'])
 '''
 
 # import json
+import os
+import importlib.util
+import numpy as np
 import networkx as nx
-# will expand the list of models
-from .metabolicModels import metabolicModels
+
+from .model_cache import default_cache_dir, file_hash, cache_file_path, \
+            write_model_cache, load_model_cache
+from .json_models import load_json_model
+from ..parameters import ADDUCT_TABLES
+from ..stageTrace import stage
+
+# JSON models shipped with mummichog
+JSON_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'json')
+
+# tables of metabolicNetwork that are unpickled from cache on first use
+CACHED_TABLES = ['Compounds', 'metabolic_pathways', 'dict_cpds_def', 'cpd2pathways', 'edge2enzyme']
+
 
 def get_remote_metabolic_model(db=None, model_id=None):
     '''
@@ -60,13 +74,64 @@ def get_remote_metabolic_model(db=None, model_id=None):
     '''
     pass
 
-def get_metabolic_model(model='human_model_mfn'):
+def find_json_model(model):
+    '''
+    Return path of a JSON model, either a file path or the name of a model under models/json/,
+    or None.
+    '''
+    for path in [model, os.path.join(JSON_MODEL_DIR, model), os.path.join(JSON_MODEL_DIR, model + '.json')]:
+        if path.endswith('.json') and os.path.isfile(path):
+            return path
+    return None
+
+def get_metabolic_model(model='metabolicModel_RECON3D_20210510', cache_dir=None):
     '''
     To-do:
     handling models from JMS and other sources
     
+    model can be a JSON model (list_of_compounds/list_of_reactions/list_of_pathways),
+    given by file path or by name under models/json/, 
+    or a model name in the Python module metabolicModels.
+    
+    A compiled binary cache is kept in cache_dir (default ~/.cache/mummichog, or $MUMMICHOG_CACHE_DIR),
+    keyed by the hash of model source file. Later runs memory-map the cache, 
+    without parsing or converting the model, or building the network graph.
+    Use cache_dir=False to disable the cache.
     '''
-    return metabolicNetwork(metabolicModels[ model ])
+    with stage('get_metabolic_model') as r:
+        r['model'] = model
+        json_path = find_json_model(model)
+        if json_path:
+            source = json_path
+            model = os.path.splitext(os.path.basename(json_path))[0]
+            load_model = lambda: load_json_model(json_path)
+        else:
+            # will expand the list of models
+            spec = importlib.util.find_spec(__package__ + '.metabolicModels')
+            source = spec.origin if spec is not None else None
+            def load_model():
+                from .metabolicModels import metabolicModels
+                return metabolicModels[ model ]
+
+        if cache_dir is False or not source or not os.path.exists(source):
+            r['model_cache'] = 'disabled'
+            return metabolicNetwork(load_model())
+
+        cache_dir = cache_dir or default_cache_dir()
+        source_hash = file_hash(source)
+        cache_path = cache_file_path(cache_dir, model, source_hash)
+        cache = load_model_cache(cache_path, source_hash)
+        if cache is not None:
+            r['model_cache'] = 'hit'
+            return metabolicNetwork.from_cache(cache)
+        
+        r['model_cache'] = 'miss'
+        MN = metabolicNetwork(load_model())
+        try:
+            MN.write_cache(cache_path, source_hash)
+        except (OSError, ValueError) as e:
+            print("Could not write model cache %s: %s" %(cache_path, e))
+        return MN
 
 
 class metabolicNetwork:
@@ -76,6 +141,8 @@ class metabolicNetwork:
 
     This is from # from metDataModel.mummichog import metabolicNetwork
 
+    When loaded from a compiled cache (metabolicNetwork.from_cache),
+    network and the tables in CACHED_TABLES are only built when first used.
 
     '''
     def __init__(self, MetabolicModel):
@@ -100,12 +167,256 @@ class metabolicNetwork:
         self.cpd2pathways = MetabolicModel['cpd2pathways']
         self.edge2enzyme = MetabolicModel['edge2enzyme']
         self.total_cpd_list = self.network.nodes()
+        self.mass_index = CompoundMassIndex(self.Compounds)
         
+    @classmethod
+    def from_cache(cls, cache):
+        '''
+        Initiation from a ModelCache, without parsing or graph construction.
+        '''
+        MN = cls.__new__(cls)
+        MN.cache = cache
+        MN.version = cache.meta['version']
+        compound_ids = cache.array('compound_ids')
+        MN.mass_index = CompoundMassIndex.from_arrays(
+            compound_ids[cache.array('mass_ids')].tolist(), 
+            cache.array('mass_order'), cache.array('mass_sorted'))
+        return MN
+
+    def __getattr__(self, name):
+        '''
+        Only called for attributes not set yet, i.e. lazy loading from cache.
+        '''
+        cache = self.__dict__.get('cache', None)
+        if cache is None:
+            raise AttributeError(name)
+        if name in CACHED_TABLES:
+            value = cache.table(name)
+        elif name == 'network':
+            # same edge order as the model, so that the graph is identical to nx.from_edgelist
+            compound_ids = cache.array('compound_ids')
+            edges = cache.array('edges')
+            value = self.build_network( zip(compound_ids[edges[:, 0]].tolist(), 
+                                            compound_ids[edges[:, 1]].tolist()) )
+        elif name == 'total_cpd_list':
+            value = self.network.nodes()
+        else:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
         
+    def preload(self):
+        '''
+        Build all lazily loaded attributes now, e.g. before a server forks its workers,
+        so that they are shared and no job pays for them.
+        '''
+        for name in CACHED_TABLES + ['network', 'total_cpd_list']:
+            getattr(self, name)
+        for mode in ('pos_default', 'neg_default'):
+            self.get_adduct_index(mode)
+        return self
+
+    def get_adduct_index(self, mode='pos_default'):
+        '''
+        AdductMassIndex of model compounds for ionization mode (see adduct_mode), built once per mode.
+        '''
+        mode = adduct_mode(mode)
+        indexes = self.__dict__.setdefault('adduct_indexes', {})
+        if mode not in indexes:
+            indexes[mode] = AdductMassIndex(self.mass_index, ADDUCT_TABLES[mode])
+        return indexes[mode]
+
     def build_network(self, edges):
         return nx.from_edgelist( edges )
         
+    def get_csr_adjacency(self):
+        '''
+        Adjacency of network in CSR arrays, on integer node indices.
+        Neighbor order is the same as in self.network.adj.
+        
+        Return:
+            [node IDs in network order], indptr, indices
+        '''
+        if 'network' not in self.__dict__ and 'cache' in self.__dict__:
+            node_ids = self.cache.array('compound_ids')[self.cache.array('network_nodes')].tolist()
+            return node_ids, self.cache.array('adjacency_indptr'), self.cache.array('adjacency_indices')
+        
+        node_ids = list(self.network.nodes())
+        node_index = dict(zip(node_ids, range(len(node_ids))))
+        degrees = [len(self.network.adj[n]) for n in node_ids]
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(degrees)
+        indices = np.array([node_index[x] for n in node_ids for x in self.network.adj[n]], dtype=np.int32)
+        return node_ids, indptr, indices
+
+    def write_cache(self, path, source_hash):
+        '''
+        Compile this model into a binary cache file (see model_cache.py).
+        All compound references are integer indices into one compound ID table.
+        '''
+        node_ids, indptr, indices = self.get_csr_adjacency()
+        compound_ids = list(self.Compounds)
+        cpd_index = dict(zip(compound_ids, range(len(compound_ids))))
+        def _index(cpd):
+            if cpd not in cpd_index:
+                cpd_index[cpd] = len(compound_ids)
+                compound_ids.append(cpd)
+            return cpd_index[cpd]
+
+        network_nodes = [_index(n) for n in node_ids]
+        edges = [(_index(e[0]), _index(e[1])) for e in self.MetabolicModel['cpd_edges']]
+        pathway_indptr, pathway_indices = [0], []
+        for P in self.metabolic_pathways:
+            pathway_indices += [_index(c) for c in P['cpds']]
+            pathway_indptr.append(len(pathway_indices))
+
+        arrays = {
+            'compound_ids': np.array(compound_ids, dtype=str),
+            'network_nodes': np.array(network_nodes, dtype=np.int32),
+            'edges': np.array(edges, dtype=np.int32).reshape(-1, 2),
+            'adjacency_indptr': indptr,
+            'adjacency_indices': indices,
+            'mass_ids': np.array([cpd_index[c] for c in self.mass_index.ids], dtype=np.int32),
+            'mass_order': self.mass_index.order,
+            'mass_sorted': self.mass_index.sorted_masses,
+            'pathway_indptr': np.array(pathway_indptr, dtype=np.int64),
+            'pathway_indices': np.array(pathway_indices, dtype=np.int32),
+        }
+        tables = {name: getattr(self, name) for name in CACHED_TABLES}
+        write_model_cache(path, source_hash, arrays, tables, meta={'version': self.version})
 
     def get_pathways(self):
         pass
 
+
+
+def ppm_join(sorted_values, queries, ppm):
+    '''
+    All pairs of query and value within ppm of the query, by binary search over sorted values.
+    Boundary candidates are widened slightly, then filtered by the exact test
+    abs(value - query) <= ppm * query / 1e6, as in a linear scan.
+
+    Return:
+        (query indices, positions in sorted_values), arrays of matched pairs in order of query
+    '''
+    tol = ppm * queries / 1e6
+    margin = np.abs(tol) * 1e-6 + 1e-9
+    lo = np.searchsorted(sorted_values, queries - tol - margin, side='left')
+    hi = np.searchsorted(sorted_values, queries + tol + margin, side='right')
+    counts = np.maximum(hi - lo, 0)
+
+    # flatten all candidate ranges, then apply the exact tolerance test
+    query_idx = np.repeat(np.arange(queries.size), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(lo, counts) + offsets
+    keep = np.abs(sorted_values[positions] - queries[query_idx]) <= tol[query_idx]
+    return query_idx[keep], positions[keep]
+
+
+def adduct_mode(mode):
+    '''
+    Name of adduct table in ADDUCT_TABLES for ionization mode, e.g. 'pos', 'neg' or 'pos_default'.
+    '''
+    if mode in ADDUCT_TABLES:
+        return mode
+    return 'neg_default' if str(mode or '').lower().startswith('neg') else 'pos_default'
+
+
+class CompoundMassIndex:
+    '''
+    Sorted neutral mass index of model compounds, built once per metabolicNetwork.
+    Only compounds with mw are indexed. 
+    Query results are returned in the order of model.Compounds, 
+    same as a linear scan over the compound dict.
+    '''
+    def __init__(self, Compounds):
+        self.ids, masses = [], []
+        for cpd_id, cpd in Compounds.items():
+            if cpd['mw']:  # only consider those with mw
+                self.ids.append(cpd_id)
+                masses.append(cpd['mw'])
+        masses = np.array(masses, dtype=np.float64)
+        # stable sort keeps dict order among identical masses
+        self.order = np.argsort(masses, kind='stable')
+        self.sorted_masses = masses[self.order]
+
+    @classmethod
+    def from_arrays(cls, ids, order, sorted_masses):
+        '''
+        Index from precomputed arrays, e.g. memory-mapped from model cache.
+        '''
+        index = cls.__new__(cls)
+        index.ids, index.order, index.sorted_masses = ids, order, sorted_masses
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def batch_query(self, neutral_masses, ppm):
+        '''
+        Find compounds within ppm of each neutral mass, by binary search over sorted masses.
+        Boundary candidates are widened slightly, then filtered by the exact test
+        abs(mw - mass) <= ppm * mass / 1e6, as in a linear scan.
+
+        Return:
+            [[cpd_id, ...], ...] per input mass, in the order of model.Compounds
+        '''
+        masses = np.asarray(neutral_masses, dtype=np.float64)
+        results = [[] for _ in range(masses.size)]
+        if masses.size == 0 or not self.ids:
+            return results
+        query_idx, positions = ppm_join(self.sorted_masses, masses, ppm)
+        cpd_idx = self.order[positions]
+
+        # group by query, restoring compound dict order within each group
+        grouping = np.lexsort((cpd_idx, query_idx))
+        for q, c in zip(query_idx[grouping].tolist(), cpd_idx[grouping].tolist()):
+            results[q].append(self.ids[c])
+        return results
+
+    def query(self, neutral_mass, ppm):
+        return self.batch_query([neutral_mass], ppm)[0]
+
+
+class AdductMassIndex:
+    '''
+    Sorted m/z of all ions (adducts, isotopes) of indexed model compounds in one ionization mode,
+    from the adduct table ADDUCT_TABLES[mode], built on a CompoundMassIndex.
+    '''
+    def __init__(self, mass_index, adducts):
+        self.ids = mass_index.ids
+        self.adducts = [a[0] for a in adducts]
+        # one block per adduct, each in the order of sorted neutral masses
+        mz = np.concatenate([(mass_index.sorted_masses + delta) / charge for name, delta, charge in adducts]
+                            or [np.empty(0)])
+        cpd_idx = np.tile(np.asarray(mass_index.order, dtype=np.int64), len(adducts))
+        adduct_idx = np.repeat(np.arange(len(adducts), dtype=np.int32), len(mass_index.order))
+        order = np.argsort(mz, kind='stable')
+        self.sorted_mz, self.cpd_idx, self.adduct_idx = mz[order], cpd_idx[order], adduct_idx[order]
+
+    def __len__(self):
+        return self.sorted_mz.size
+
+    def batch_query(self, mz_values, ppm):
+        '''
+        Match m/z values to ions of model compounds within ppm, in one sorted join.
+        A compound matched by several ions is reported once, by the first ion in the adduct table.
+
+        Return:
+            [[(cpd_id, ion), ...], ...] per input m/z, in the order of model.Compounds
+        '''
+        mz_values = np.asarray(mz_values, dtype=np.float64)
+        results = [[] for _ in range(mz_values.size)]
+        if mz_values.size == 0 or not self.sorted_mz.size:
+            return results
+        query_idx, positions = ppm_join(self.sorted_mz, mz_values, ppm)
+        cpd_idx, adduct_idx = self.cpd_idx[positions], self.adduct_idx[positions]
+
+        # group by query and compound, first ion of each compound
+        grouping = np.lexsort((adduct_idx, cpd_idx, query_idx))
+        query_idx, cpd_idx, adduct_idx = query_idx[grouping], cpd_idx[grouping], adduct_idx[grouping]
+        first = np.ones(query_idx.size, dtype=bool)
+        first[1:] = (query_idx[1:] != query_idx[:-1]) | (cpd_idx[1:] != cpd_idx[:-1])
+        for q, c, a in zip(query_idx[first].tolist(), cpd_idx[first].tolist(), adduct_idx[first].tolist()):
+            results[q].append((self.ids[c], self.adducts[a]))
+        return results
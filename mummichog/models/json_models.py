@@ -0,0 +1,207 @@
+'''
+Loading metabolic models in JSON,
+in the format of list_of_compounds, list_of_reactions and list_of_pathways (see README),
+into the internal indexes of metabolicNetwork:
+dict_keys(['id', 'version', 'Compounds', 'dict_cpds_def', 'metabolic_rxns', 'cpd_edges', 'edge2rxn', 'edge2enzyme', 'metabolic_pathways', 'cpd2pathways'])
+
+Compound edges are derived from reactions (reactant - product), excluding currency metabolites.
+Pathway compounds are mapped through pathway reactions.
+The file is read in one streaming pass: compounds and reactions are decoded and converted
+one at a time (see iter_json_model), without parsing the whole document first.
+If neutral_mono_mass is not provided, it is calculated from neutral_formula,
+or from charged_formula and charge by adding/removing protons.
+'''
+
+import re
+
+from ..annotate.empCpdStream import _JSONStream
+
+# sections of a JSON model decoded item by item
+LIST_SECTIONS = ('list_of_compounds', 'list_of_reactions', 'list_of_pathways')
+
+# Currency metabolites to be excluded from edges and pathways, KEGG and BiGG IDs
+currency = ['C00001', 'C00080', 'C00007', 'C00006', 'C00005', 'C00003',
+            'C00004', 'C00002', 'C00013', 'C00008', 'C00009', 'C00011',
+            'G11113', '',
+            'h2o', 'h', 'o2', 'nadp', 'nadph', 'nad', 'nadh', 'atp',
+            'ppi', 'adp', 'pi', 'co2',]
+
+# monoisotopic masses of elements
+ELEMENT_MASSES = {
+    'H': 1.00782503207, 'C': 12.0, 'N': 14.0030740048, 'O': 15.99491461956,
+    'P': 30.97376163, 'S': 31.97207100, 'F': 18.99840322, 'Cl': 34.96885268,
+    'Br': 78.9183371, 'I': 126.904473, 'Se': 79.9165213, 'Na': 22.9897692809,
+    'K': 38.96370668, 'Li': 7.01600455, 'Mg': 23.9850417, 'Ca': 39.96259098,
+    'Fe': 55.9349375, 'Co': 58.933195, 'Cu': 62.9295975, 'Zn': 63.9291422,
+    'Mn': 54.9380451, 'Mo': 97.9054082, 'Ni': 57.9353429, 'As': 74.9215965,
+    'Ba': 137.9052472, 'B': 11.0093054, 'Si': 27.9769265325,
+}
+
+
+def parse_formula(formula):
+    '''
+    Return {element: count, ...} in order of appearance,
+    or None if formula contains non-element symbols, e.g. R groups.
+    '''
+    counts = {}
+    for element, count in re.findall(r'([A-Z][a-z]?)(\d*)', formula or ''):
+        if element not in ELEMENT_MASSES:
+            return None
+        counts[element] = counts.get(element, 0) + (int(count) if count else 1)
+    if not counts or ''.join(re.findall(r'[A-Z][a-z]?\d*', formula)) != formula:
+        return None
+    return counts
+
+def neutral_formula_and_mass(cpd):
+    '''
+    Neutral formula and monoisotopic mass of a compound in list_of_compounds.
+    Charged formula is neutralized by protons, e.g. C3H3O3 (charge -1) to C3H4O3.
+
+    Return:
+        (neutral_formula, mass), ('', 0) if not computable
+    '''
+    counts = parse_formula(cpd.get('neutral_formula', ''))
+    if counts is None:
+        counts = parse_formula(cpd.get('charged_formula', ''))
+        if counts is None:
+            return '', 0
+        counts['H'] = counts.get('H', 0) - (cpd.get('charge', 0) or 0)
+        if counts['H'] < 0:
+            return '', 0
+    formula = ''.join([e + (str(n) if n > 1 else '') for e, n in counts.items() if n > 0])
+    mass = cpd.get('neutral_mono_mass', 0) or sum([ELEMENT_MASSES[e] * n for e, n in counts.items()])
+    return formula, mass
+
+
+def convert_json_model(jmodel, currency_metabolites=currency):
+    '''
+    Convert a JSON model of list_of_compounds, list_of_reactions and list_of_pathways
+    to the dict layout used by metabolicNetwork.
+    '''
+    return convert_model_sections(jmodel.items(), currency_metabolites)
+
+def convert_model_sections(sections, currency_metabolites=currency):
+    '''
+    Convert (key, value) sections of a JSON model, in file order, as by iter_json_model.
+    Compounds and reactions are converted as they come, in one pass,
+    for edges, edge2rxn, edge2enzyme and reaction compounds;
+    pathways are mapped to compounds via their reactions once all reactions are read,
+    as list_of_pathways may come first in the file.
+    '''
+    currency_metabolites = set(currency_metabolites)
+    Compounds, dict_cpds_def = {}, {}
+    metabolic_rxns, cpd_edges, edge2rxn, edge2enzyme = [], [], {}, {}
+    rxn2cpds, rxn2ecs = {}, {}
+    list_of_pathways, others = [], {}
+    for key, value in sections:
+        if key == 'list_of_compounds':
+            for cpd in value:
+                formula, mw = neutral_formula_and_mass(cpd)
+                Compounds[cpd['id']] = {'formula': formula, 'mw': mw, 'name': cpd.get('name', ''), 'adducts': {}}
+                dict_cpds_def[cpd['id']] = cpd.get('name', '')
+
+        elif key == 'list_of_reactions':
+            for rxn in value:
+                metabolic_rxns.append(rxn)
+                reactants = [x for x in rxn['reactants'] if x not in currency_metabolites]
+                products = [x for x in rxn['products'] if x not in currency_metabolites]
+                ecs = rxn.get('ecs', []) or rxn.get('enzymes', [])
+                rxn2cpds[rxn['id']] = list(dict.fromkeys(reactants + products))
+                rxn2ecs[rxn['id']] = ecs
+                for a in reactants:
+                    for b in products:
+                        if a != b:          # skip transport reactions
+                            edge = ','.join(sorted([a, b]))
+                            if edge not in edge2rxn:
+                                cpd_edges.append((a, b))
+                                edge2rxn[edge] = rxn['id']
+                            if ecs and edge not in edge2enzyme:
+                                edge2enzyme[edge] = ';'.join(ecs)
+
+        elif key == 'list_of_pathways':
+            list_of_pathways = list(value)
+        else:
+            others[key] = value
+
+    metabolic_pathways, cpd2pathways = [], {}
+    for pathway in list_of_pathways:
+        rxns = pathway.get('list_of_reactions', [])
+        cpds, ecs = {}, {}
+        for r in rxns:
+            cpds.update(dict.fromkeys(rxn2cpds.get(r, [])))
+            ecs.update(dict.fromkeys(rxn2ecs.get(r, [])))
+        metabolic_pathways.append({
+            'id': pathway['id'],
+            'name': pathway.get('name', ''),
+            'rxns': rxns,
+            'ecs': list(ecs),
+            'cpds': list(cpds),
+        })
+        for c in cpds:
+            cpd2pathways.setdefault(c, []).append(pathway['id'])
+
+    meta_data = others.get('meta_data', {})
+    return {
+        'id': others.get('id', ''),
+        'version': meta_data.get('version', '') or others.get('id', ''),
+        'Compounds': Compounds,
+        'dict_cpds_def': dict_cpds_def,
+        'metabolic_rxns': metabolic_rxns,
+        'cpd_edges': cpd_edges,
+        'edge2rxn': edge2rxn,
+        'edge2enzyme': edge2enzyme,
+        'metabolic_pathways': metabolic_pathways,
+        'cpd2pathways': cpd2pathways,
+    }
+
+
+def iter_json_model(f):
+    '''
+    Yield (key, value) of the top-level object of a JSON model from a text stream, in file order.
+    Values of LIST_SECTIONS are iterators decoding one item at a time, to be consumed before the next key
+    (items left are skipped); other values are decoded whole.
+    '''
+    S = _JSONStream(f)
+    if S.next_char() != '{':
+        raise ValueError("Invalid JSON model file, expecting a dict.")
+    if S.peek_char() == '}':
+        return
+    while True:
+        key = S.value()
+        if S.next_char() != ':':
+            raise ValueError("Invalid JSON model file, expecting ':'.")
+        if key in LIST_SECTIONS and S.peek_char() == '[':
+            items = _iter_list(S)
+            yield key, items
+            for x in items:
+                pass
+        else:
+            yield key, S.value()
+        c = S.next_char()
+        if c == '}':
+            return
+        elif c != ',':
+            raise ValueError("Invalid JSON model file, expecting ',' or '}'.")
+
+def _iter_list(S):
+    '''
+    Yield the items of a JSON list in stream S, from its opening bracket.
+    '''
+    S.next_char()
+    if S.peek_char() == ']':
+        S.next_char()
+        return
+    while True:
+        yield S.value()
+        c = S.next_char()
+        if c == ']':
+            return
+        elif c != ',':
+            raise ValueError("Invalid JSON model file, expecting ',' or ']'.")
+
+def load_json_model(path):
+    '''
+    Read a JSON model file by streaming and convert to metabolicNetwork dict layout.
+    '''
+    with open(path, encoding='utf-8') as f:
+        return convert_model_sections(iter_json_model(f))
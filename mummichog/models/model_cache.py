@@ -0,0 +1,138 @@
+'''
+Compiled binary cache of metabolic models.
+
+A metabolic model is compiled once into a versioned binary file,
+then memory-mapped in later runs, skipping model parsing and graph construction.
+
+File layout:
+    MAGIC | format version (uint32) | header offset (uint64) | header length (uint64)
+    data sections, each aligned to 64 bytes
+    header in JSON, with source_hash and offset/dtype/shape of every section
+
+Array sections hold the compound table (IDs), mass arrays, edge list, CSR adjacency and
+pathway membership. Dict-like tables (Compounds, edge2enzyme etc.) are JSON sections,
+decoded only when first used.
+Nothing in a cache file is unpickled or executed, as the cache directory may be shared by many jobs;
+arrays of object dtype are refused.
+
+The cache is invalidated by the hash of model source file, or a change of CACHE_FORMAT_VERSION.
+'''
+
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+
+CACHE_FORMAT_VERSION = 2
+MAGIC = b'MCGMODEL'
+PREAMBLE = struct.Struct('<8sIQQ')
+ALIGNMENT = 64
+
+
+def default_cache_dir():
+    return os.environ.get('MUMMICHOG_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'mummichog'))
+
+def file_hash(path, blocksize=1 << 20):
+    '''
+    sha256 of a file, as hex string
+    '''
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_file_path(cache_dir, model, source_hash):
+    return os.path.join(cache_dir,
+                '%s.%s.v%d.mcgmodel' %(model, source_hash[:16], CACHE_FORMAT_VERSION))
+
+
+def write_model_cache(path, source_hash, arrays, tables, meta={}):
+    '''
+    Write arrays {name: np.ndarray} and tables {name: python object} to a cache file.
+    The file is written to a temporary name then moved into place,
+    so that concurrent jobs never see a partial cache.
+    Tables are written as JSON, thus must be made of dicts with str keys, lists, str and numbers;
+    ValueError if a table does not decode to an equal object.
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    header = {'format_version': CACHE_FORMAT_VERSION, 'source_hash': source_hash,
+              'meta': meta, 'arrays': {}, 'tables': {}}
+    table_bytes = {}
+    for name, obj in tables.items():
+        table_bytes[name] = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+        if json.loads(table_bytes[name]) != obj:
+            raise ValueError("Table %s is not JSON compatible, cannot be cached." %name)
+    tmp = path + '.tmp%d' %os.getpid()
+    with open(tmp, 'wb') as O:
+        O.write(PREAMBLE.pack(MAGIC, CACHE_FORMAT_VERSION, 0, 0))
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            O.write(b'\0' * (-O.tell() % ALIGNMENT))
+            header['arrays'][name] = {'offset': O.tell(), 'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+            O.write(arr.tobytes())
+        for name, b in table_bytes.items():
+            O.write(b'\0' * (-O.tell() % ALIGNMENT))
+            header['tables'][name] = {'offset': O.tell(), 'length': len(b)}
+            O.write(b)
+        header_bytes = json.dumps(header).encode('utf-8')
+        header_offset = O.tell()
+        O.write(header_bytes)
+        O.seek(0)
+        O.write(PREAMBLE.pack(MAGIC, CACHE_FORMAT_VERSION, header_offset, len(header_bytes)))
+    os.replace(tmp, path)
+
+
+class ModelCache:
+    '''
+    Read-only, memory-mapped view of a model cache file.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, header_offset, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC or version != CACHE_FORMAT_VERSION:
+                raise ValueError("Not a model cache of format version %d: %s" %(CACHE_FORMAT_VERSION, path))
+            f.seek(header_offset)
+            self.header = json.loads(f.read(header_length).decode('utf-8'))
+        self.source_hash = self.header['source_hash']
+        self.meta = self.header['meta']
+        self._mm = np.memmap(path, dtype=np.uint8, mode='r')
+
+    def __getstate__(self):
+        # reopen by path in other processes, instead of pickling mapped data
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def array(self, name):
+        spec = self.header['arrays'][name]
+        dtype = np.dtype(spec['dtype'])
+        if dtype.hasobject:
+            raise ValueError("Object array %s in model cache %s" %(name, self.path))
+        nbytes = int(np.prod(spec['shape'], dtype=np.int64)) * dtype.itemsize
+        if not nbytes:
+            return np.empty(spec['shape'], dtype=dtype)
+        return self._mm[spec['offset']: spec['offset'] + nbytes].view(dtype).reshape(spec['shape'])
+
+    def table(self, name):
+        spec = self.header['tables'][name]
+        return json.loads(self._mm[spec['offset']: spec['offset'] + spec['length']].tobytes())
+
+
+def load_model_cache(path, source_hash):
+    '''
+    Return ModelCache if path is a valid cache for source_hash, else None.
+    '''
+    if not os.path.exists(path):
+        return None
+    try:
+        cache = ModelCache(path)
+    except (ValueError, OSError, struct.error):
+        return None
+    if cache.source_hash != source_hash:
+        return None
+    return cache
@@ -6,6 +6,38 @@ Pre-annotation will be moved out of mummichog, but based on khipu.
 
 PROTON = 1.00727646677
 electron = 0.000549
+C13_SHIFT = 1.0033548378
+
+# Ions of model compounds per ionization mode, as (name, delta, charge),
+# m/z = (neutral mass + delta) / charge, after the adduct lists of mummichog 2.
+# Singleton features (no neutral mass from annotation) are matched to these by m/z.
+ADDUCT_TABLES = {
+    'pos_default': [
+        ('M+H[1+]', PROTON, 1),
+        ('M+Na[1+]', 22.98922070, 1),
+        ('M+K[1+]', 38.96315810, 1),
+        ('M+NH4[1+]', 18.03382555, 1),
+        ('M(C13)+H[1+]', PROTON + C13_SHIFT, 1),
+        ('M+H-H2O[1+]', PROTON - 18.01056468, 1),
+        ('M+HCOONa[1+]', PROTON + 67.98742355, 1),
+        ('M+2H[2+]', 2*PROTON, 2),
+        ('M+H+Na[2+]', PROTON + 22.98922070, 2),
+    ],
+    'neg_default': [
+        ('M-H[-]', -PROTON, 1),
+        ('M(C13)-H[-]', -PROTON + C13_SHIFT, 1),
+        ('M+Cl[-]', 34.96940126, 1),
+        ('M+Na-2H[-]', 20.97466780, 1),
+        ('M+K-2H[-]', 36.94860520, 1),
+        ('M-H2O-H[-]', -PROTON - 18.01056468, 1),
+        ('M+HCOO[-]', 44.99820285, 1),
+        ('M+CH3COO[-]', 59.01385292, 1),
+        ('M-2H[2-]', -2*PROTON, 2),
+    ],
+    # primary ions only, as singletons were matched before adduct tables
+    'pos_primary': [('M+H[1+]', PROTON, 1)],
+    'neg_primary': [('M-H[-]', -PROTON, 1)],
+}
 
 SIGNIFICANCE_CUTOFF = 0.05
 MASS_RANGE = (50, 2000)
@@ -15,7 +47,7 @@ MASS_RANGE = (50, 2000)
 RETENTION_TIME_TOLERANCE_FRAC = 0.02    
 
 PARAMETERS = {
-    'network': 'human_model_mfn',   # metabolic model to use
+    'network': 'metabolicModel_RECON3D_20210510',   # metabolic model to use, name or JSON file
     'mode': 'pos_default',    # analytical mode of mass spec
     'instrument': 'unspecified',  # instrument type, for future use
     'cutoff': 0.05,              # p-value cutoff to select significant features
@@ -24,5 +56,16 @@ PARAMETERS = {
     'input': '',              # input data file
     'output': '',             # output file prefix
     'permutation': 100,       # number of permutations to estimate null distributions
+    'permutation_engine': 'trio',   # pathway permutations by 'trio' EmpCpd bitsets or 'sparse' matrix products
+    'permutation_mode': 'fixed',    # pathway permutations 'fixed' in number, or 'adaptive' with early stopping
+    'permutation_error': 0.2,       # relative error of adaptive permutation p-values, stopping at 1/error^2 exceedances
+    'jobs': 1,                # number of processes for module permutations
+    'seed': None,             # root seed of random streams in permutations, None for fresh entropy per run
+    'null_cache_dir': None,   # cache of permutation records, None for default, False to disable; used with seed
+    'null_cache_size': 1024,  # size limit of permutation cache in MB, least recently used removed first
+    'trace': None,            # JSON file of stage timings, memory and counts (see stageTrace.py), None to disable
+    'profile': False,         # cProfile each stage, dumped as .prof files next to the trace file
+    'json_output': 'mcg_output.json',   # JSON result file, in output directory if a relative path; .gz to compress
+    'gzip': False,            # gzip compress JSON results, adding .gz to file names
     'outdir': 'mcgresult',    # output directory name
 }
@@ -13,9 +13,9 @@ import csv
 from .websnippets import *
 
 #
-# to remove dependency from matplotlib in ver 3
+# matplotlib is imported only by the plotting functions (see reporting.py),
+# not when the report helpers are imported
 #
-import matplotlib.pyplot as plt
 
 class WebReporting:
     '''
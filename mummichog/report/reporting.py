@@ -5,17 +5,113 @@ import logging
 
 '''
 
+import io
+import json
+import gzip
+import itertools
+
+# items per chunk of large dicts and lists in write_json_sections
+JSON_CHUNK_SIZE = 5000
+
+
+def json_export_sections(mixedNetwork, PA, MA, AN):
+    '''
+    Sections of mcg_output.json in order, as (name, section) pairs,
+    each made when iterated to, so that a writer may encode one section at a time.
+    '''
+    yield 'seed', PA.permutation_entropy
+    yield 'EmpiricalCompounds', mixedNetwork.to_json()
+    yield 'pathway_analysis', PA.to_json()      #force_ascii=True),
+    yield 'module_analysis', MA.to_json()
+    yield 'activity_network', AN.to_json()
+
+
 def json_export_all(mixedNetwork, PA, MA, AN):
     '''
     metabolic model is already in JSON, but need clean up.
+    seed is the root seed of permutations, to reproduce the run with --seed.
     '''
-    return {
-        'EmpiricalCompounds': mixedNetwork.to_json(),
-        'pathway_analysis': PA.to_json(),     #force_ascii=True),
-        'module_analysis': MA.to_json(), 
-        
-        'activity_network': AN.to_json(),
-    }
+    return dict(json_export_sections(mixedNetwork, PA, MA, AN))
+
+
+def __json_key__(k):
+    '''
+    dict key as converted by json, which allows str, int, float, bool and None keys
+    '''
+    if isinstance(k, str):
+        return k
+    if k is None or isinstance(k, (int, float)):
+        return json.dumps(k)
+    raise TypeError("keys must be str, int, float, bool or None, not %s" %type(k).__name__)
+
+
+def iter_json_chunks(obj, encoder, depth=2, chunk_size=JSON_CHUNK_SIZE):
+    '''
+    Encode obj to JSON text in chunks, the same text as encoder.encode(obj).
+    dicts and lists are split into chunks of chunk_size items, down to depth levels,
+    each chunk encoded by the C encoder; deeper values are encoded whole.
+    '''
+    if depth <= 0 or not isinstance(obj, (dict, list, tuple)) or not obj:
+        yield encoder.encode(obj)
+        return
+
+    is_dict = isinstance(obj, dict)
+    items = iter(obj.items() if is_dict else obj)
+    yield '{' if is_dict else '['
+    sep = ''
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            break
+        if depth > 1:
+            for x in chunk:
+                if is_dict:
+                    yield sep + encoder.encode(__json_key__(x[0])) + ': '
+                    yield from iter_json_chunks(x[1], encoder, depth - 1, chunk_size)
+                else:
+                    yield sep
+                    yield from iter_json_chunks(x, encoder, depth - 1, chunk_size)
+                sep = ', '
+        else:
+            # strip brackets of the encoded chunk
+            yield sep + encoder.encode(dict(chunk) if is_dict else chunk)[1:-1]
+            sep = ', '
+    yield '}' if is_dict else ']'
+
+
+def write_json_sections(sections, path, compress=None, chunk_size=JSON_CHUNK_SIZE):
+    '''
+    Write a JSON object of (name, section) pairs to path, encoding one section at a time in chunks,
+    without holding the encoded output in memory.
+    The text is the same as json.JSONEncoder().encode(dict(sections)).
+    Output is gzip compressed if compress, or if compress is None and path ends with .gz.
+
+    Return:
+        number of characters written, before compression
+    '''
+    if compress is None:
+        compress = path.endswith('.gz')
+    encoder = json.JSONEncoder()
+    if compress:
+        O = io.TextIOWrapper(gzip.open(path, 'wb', compresslevel=6), encoding='utf-8')
+    else:
+        O = open(path, 'w', encoding='utf-8')
+    if isinstance(sections, dict):
+        sections = sections.items()
+    size = 0
+    with O:
+        def write(s):
+            nonlocal size
+            O.write(s)
+            size += len(s)
+        sep = '{'
+        for name, section in sections:
+            write(sep + encoder.encode(__json_key__(name)) + ': ')
+            for s in iter_json_chunks(section, encoder, 2, chunk_size):
+                write(s)
+            sep = ', '
+        write('{}' if sep == '{' else '}')
+    return size
     
 
 
@@ -33,8 +129,8 @@ def json_export_all(mixedNetwork, PA, MA, AN):
         P.p_EASE for P in self.resultListOfPathways
         Use -log10 scale, to show upward trend, consistent with other plots
         '''
-        self.permutation_record.sort()
-        Y_data = [-np.log10(x) for x in self.permutation_record]
+        import matplotlib.pyplot as plt         # slow import, only needed for plots
+        Y_data = -np.log10(np.sort(self.permutation_record))
         fig = plt.figure(figsize=(5,4))
         plt.plot(range(len(Y_data)), Y_data, 'b.')
         for P in self.resultListOfPathways[:10]:
@@ -53,6 +149,7 @@ def json_export_all(mixedNetwork, PA, MA, AN):
         Horizontal barplot of pathways.
         Also returnin-memory string for web use
         '''
+        import matplotlib.pyplot as plt
         use_pathways = [P for P in self.resultListOfPathways if P.adjusted_p < SIGNIFICANCE_CUTOFF]
         if len(use_pathways) < 6:
             use_pathways = self.resultListOfPathways[:6]
@@ -89,10 +186,11 @@ def json_export_all(mixedNetwork, PA, MA, AN):
         Plot module activity against self.permuation_mscores
         
         '''
-        self.permuation_mscores.sort(reverse=True)
-        NN = len(self.permuation_mscores)
+        import matplotlib.pyplot as plt
+        mscores = np.sort(self.permuation_mscores)[::-1]
+        NN = len(mscores)
         fig = plt.figure(figsize=(5,4))
-        plt.plot(range(NN), self.permuation_mscores, 'bo')
+        plt.plot(range(NN), mscores, 'bo')
         for M in self.modules_from_significant_features:
             plt.plot([0, 0.1*NN], [M.A, M.A], 'r-')
         
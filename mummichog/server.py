@@ -0,0 +1,313 @@
+# Licensed under the BSD 3-Clause License.
+#
+# mummichog - pathway and network analysis for metabolomics
+#
+
+'''
+Local analysis server with metabolic models kept in memory (warm models),
+for interactive jobs where model loading and imports would dominate latency.
+
+    mummichog serve --port 8765 --max_jobs 2
+
+Metabolic models are loaded and fully built (network graph, mass index, pathways) at start,
+then jobs run in a pool of max_jobs worker processes, forked from the server where supported,
+so that workers share the loaded models. Jobs beyond max_jobs wait in a queue of max_queue;
+further requests are refused with HTTP 503.
+
+HTTP API on localhost, JSON in and out:
+    POST /run       {"features": "<feature table text, as input file>",
+                     "parameters": {"cutoff": 0.05, "permutation": 100, ...}}
+                    or with "parameters": {"workdir": ..., "infile": ..., "annotation": ...}
+                    for files on the server.
+                    Response: {"result": <json_export_all payload>,
+                               "timings": {stage: seconds, ...}, "stages": [stage records, as in --trace],
+                               "log": "<printed output>"}
+    GET /status     loaded models, running and queued jobs, requests served
+
+Parameters are the same as PARAMETERS/command line options of main().
+'''
+
+import io
+import os
+import json
+import shutil
+import tempfile
+import time
+import argparse
+import threading
+import contextlib
+import multiprocessing
+import concurrent.futures
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from mummichog import __version__
+
+from .main import run_analyses
+from .parameters import PARAMETERS
+from .stageTrace import StageTrace, active_trace, stage
+
+DEFAULT_PORT = 8765
+MAX_REQUEST_BYTES = 1 << 30
+
+# {network name: metabolicNetwork}, shared by forked workers
+_models = {}
+
+
+def load_models(networks):
+    '''
+    Load and fully build metabolic models into _models, if not loaded yet.
+    '''
+    from mummichog.models.get_models import get_metabolic_model
+
+    for name in networks:
+        if name not in _models:
+            _models[name] = get_metabolic_model(name).preload()
+    return _models
+
+
+def run_job(parameters):
+    '''
+    Run the mummichog pipeline in a worker process, on warm models.
+    Models not loaded at server start are loaded on first use in the worker.
+
+    Stages are recorded by stage() as with --trace, in a StageTrace of the job.
+    The result is streamed by sections to a temporary JSON file, as by main(),
+    to be sent from the file by the server and removed after.
+
+    Return:
+        (path of JSON file of json_export_all payload, stage records of the job, printed output)
+    '''
+    from .api import InputUserData, DataMeetModel
+    from .report.reporting import json_export_sections, write_json_sections
+
+    log = io.StringIO()
+    fd, path = tempfile.mkstemp(prefix='mcg_job_', suffix='.json')
+    os.close(fd)
+    try:
+        with active_trace(StageTrace()) as trace, contextlib.redirect_stdout(log):
+            userData = InputUserData(parameters, web='datatext' in parameters)
+            theoreticalModel = load_models([parameters['network']])[parameters['network']]
+            mixedNetwork = DataMeetModel(theoreticalModel, userData)
+            PA, MA, AN = run_analyses(mixedNetwork)
+            with stage('json_export') as r:
+                r['bytes'] = write_json_sections(json_export_sections(mixedNetwork, PA, MA, AN), path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, trace.records, log.getvalue()
+
+
+def stage_timings(records):
+    '''
+    {stage: wall time in seconds} of top-level stages, summed over stages of the same name
+    '''
+    timings = {}
+    for record in records:
+        if record['depth'] == 0:
+            timings[record['stage']] = timings.get(record['stage'], 0) + record['wall_time']
+    return timings
+
+
+class AnalysisServer(ThreadingHTTPServer):
+    '''
+    HTTP server dispatching jobs to a process pool of max_jobs workers.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, networks, max_jobs=2, max_queue=8, verbose=False):
+        load_models(networks)
+        self.max_jobs = max_jobs
+        self.max_queue = max_queue
+        self.verbose = verbose
+        # running and queued jobs
+        self.slots = threading.BoundedSemaphore(max_jobs + max_queue)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.served = 0
+        self.pool = self.start_pool()
+        super().__init__(address, AnalysisRequestHandler)
+
+    def start_pool(self):
+        '''
+        Worker processes are started here, before request threads, from the process with loaded models.
+        '''
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        pool = concurrent.futures.ProcessPoolExecutor(self.max_jobs, mp_context=context)
+        pool.submit(len, ()).result()
+        return pool
+
+    def submit(self, parameters):
+        '''
+        Run a job in the pool, waiting for its result.
+
+        Return:
+            (path of JSON file of result, stage records, printed output), or None if the queue is full
+        '''
+        if not self.slots.acquire(blocking=False):
+            return None
+        try:
+            with self.lock:
+                self.active += 1
+                pool = self.pool
+            return pool.submit(run_job, parameters).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            # a worker was killed, e.g. out of memory; replace the pool for later jobs
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = self.start_pool()
+            raise
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.served += 1
+            self.slots.release()
+
+    def status(self):
+        with self.lock:
+            return {'version': __version__, 'models': sorted(_models),
+                    'max_jobs': self.max_jobs, 'max_queue': self.max_queue,
+                    'active_jobs': self.active, 'requests_served': self.served}
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, code, body):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json_file(self, code, head, path, tail):
+        '''
+        Send head, the JSON file at path and tail as one JSON body, copying the file in blocks.
+        '''
+        head, tail = head.encode('utf-8'), tail.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(head) + os.path.getsize(path) + len(tail)))
+        self.end_headers()
+        self.wfile.write(head)
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, 1 << 20)
+        self.wfile.write(tail)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, self.server.status())
+        else:
+            self.send_json(404, {'error': 'Not found: %s' %self.path})
+
+    def do_POST(self):
+        if self.path != '/run':
+            return self.send_json(404, {'error': 'Not found: %s' %self.path})
+        t0 = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_REQUEST_BYTES:
+                return self.send_json(413, {'error': 'Request is too large.'})
+            request = json.loads(self.rfile.read(length) or b'{}')
+            parameters = PARAMETERS.copy()
+            parameters.update(request.get('parameters', {}))
+            if 'features' in request:
+                parameters['datatext'] = request['features']
+            elif not parameters.get('infile'):
+                raise ValueError("Request needs features, or parameters infile.")
+            parameters.setdefault('workdir', '')
+        except (ValueError, AttributeError) as e:
+            return self.send_json(400, {'error': str(e)})
+
+        try:
+            job = self.server.submit(parameters)
+        except ValueError as e:
+            # mostly from parsing user data
+            return self.send_json(400, {'error': '%s: %s' %(type(e).__name__, e)})
+        except Exception as e:
+            return self.send_json(500, {'error': '%s: %s' %(type(e).__name__, e)})
+        if job is None:
+            return self.send_json(503, {'error': 'Server is busy, %d jobs running or queued.'
+                                        %(self.server.max_jobs + self.server.max_queue)})
+
+        result_path, stages, log = job
+        try:
+            timings = stage_timings(stages)
+            total = time.perf_counter() - t0
+            timings['queue_wait'] = max(0.0, total - sum(timings.values()))
+            timings['total'] = total
+            print("%s %s %.3f s (%s)" %(time.strftime('%H:%M:%S'), self.path, total,
+                ', '.join(['%s %.3f' %(k, v) for k, v in timings.items() if k != 'total'])))
+            # result is already JSON encoded in the file, not to be parsed again here
+            self.send_json_file(200, '{"timings": %s, "stages": %s, "log": %s, "result": '
+                                %(json.dumps(timings), json.dumps(stages), json.dumps(log)), result_path, '}')
+        finally:
+            os.remove(result_path)
+
+
+def request_run(features=None, parameters={}, url='http://127.0.0.1:%d' %DEFAULT_PORT, timeout=None):
+    '''
+    Client of a running server: run a job on feature table text (or parameters['infile']).
+
+    Return:
+        {'result': json_export_all payload, 'timings': {...}, 'log': '...'}
+    '''
+    request = {'parameters': parameters}
+    if features is not None:
+        request['features'] = features
+    req = urllib.request.Request(url.rstrip('/') + '/run', data=json.dumps(request).encode('utf-8'),
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as f:
+        return json.loads(f.read())
+
+
+def build_parser(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='mummichog serve',
+        description='mummichog v%s local analysis server, with metabolic models kept in memory' %__version__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+            help='address to listen on; keep to localhost, as jobs can read server files')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+            help='port to listen on')
+    parser.add_argument('-n', '--networks', type=str, nargs='+', default=[PARAMETERS['network']],
+            help='metabolic models to load at start')
+    parser.add_argument('--max_jobs', type=int, default=2,
+            help='number of jobs running at the same time, as worker processes')
+    parser.add_argument('--max_queue', type=int, default=8,
+            help='number of jobs waiting for a worker, beyond which requests are refused')
+    parser.add_argument('--verbose', action='store_true',
+            help='log every HTTP request')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = build_parser(argv)
+    print("mummichog version %s, loading models %s ..." %(__version__, ', '.join(args.networks)))
+    t0 = time.perf_counter()
+    server = AnalysisServer((args.host, args.port), args.networks,
+                            max(1, args.max_jobs), max(0, args.max_queue), args.verbose)
+    print("Models loaded in %.2f s. Serving on http://%s:%d, %d jobs at a time."
+          %(time.perf_counter() - t0, args.host, args.port, server.max_jobs))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+
+    main()
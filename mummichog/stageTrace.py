@@ -0,0 +1,219 @@
+# Licensed under the BSD 3-Clause License.
+#
+# mummichog - pathway and network analysis for metabolomics
+#
+
+'''
+Stage-level trace of a run: wall time, CPU time, memory and item counts per stage,
+written as JSON with --trace, and optionally per-stage cProfile output with --profile.
+
+Stages are marked in the code by
+    with stage('DataMeetModel') as r:
+        ...
+        r['Trios'] = len(TrioList)
+where r is the record of the stage, to which item counts are added.
+Without an active trace, stage() only yields a dict to be discarded, at negligible cost.
+
+A stage within another stage is recorded with its parent, so that the trace is a tree in order of start:
+    {"stage": "ModularAnalysis.do_permutations", "index": 9, "parent": 7, "depth": 1,
+     "wall_time": 12.3, "cpu_time": 12.1, "children_cpu_time": 0.0,
+     "rss_before": ..., "rss_after": ..., "peak_rss": ..., "permutations": 100, ...}
+children_cpu_time is CPU time of finished child processes, e.g. module permutations with --jobs.
+peak_rss is the peak resident memory of the process so far (Linux/macOS), thus the stage that raised it is visible.
+A stage that raised an exception has "error": exception class name; the trace of a failed run is still written.
+
+With --profile, each stage runs under cProfile and is dumped to
+    <trace file without .json>_<index>_<stage>.prof
+to be read by pstats or snakeviz. Time of a nested stage is in its own file, not in its parent's.
+Work in child processes (--jobs) is not profiled.
+
+Other callers (benchmarks, the analysis server) record the same stages in their own StageTrace by
+    with active_trace(StageTrace(use_tracemalloc=True)) as T:
+        ...
+    T.records
+With use_tracemalloc, tracemalloc_peak is the peak of Python allocations within a stage, nested stages included,
+above the allocations at its start (tracing slows down the stages).
+'''
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+import contextlib
+
+TRACE_VERSION = 1
+DEFAULT_TRACE_FILE = 'mcg_trace.json'
+
+# active StageTrace of the run, None if not tracing
+_trace = None
+
+
+def current_rss():
+    '''
+    resident set size in bytes, from /proc (Linux); None elsewhere
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def peak_rss(who='self'):
+    '''
+    peak resident set size in bytes, of the process (who='self') or its finished children ('children')
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+def children_cpu_time():
+    t = os.times()
+    return t.children_user + t.children_system
+
+
+class StageTrace:
+    '''
+    Records of stages, in self.records in order of start.
+    '''
+    def __init__(self, path=DEFAULT_TRACE_FILE, profile=False, use_tracemalloc=False):
+        self.path = path
+        self.profile = profile
+        self.use_tracemalloc = use_tracemalloc
+        self.records = []
+        self.stack = []             # (record, profiler) of open stages
+        self.started = time.time()
+        self.wall = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        parent = self.stack[-1] if self.stack else None
+        record = {'stage': name, 'index': len(self.records),
+                  'parent': parent[0]['index'] if parent else None, 'depth': len(self.stack),
+                  'rss_before': current_rss()}
+        self.records.append(record)
+        profiler = None
+        if self.profile:
+            import cProfile
+            # one profiler at a time; the parent resumes when this stage ends
+            if parent and parent[1]:
+                parent[1].disable()
+            profiler = cProfile.Profile()
+        self.stack.append((record, profiler))
+        if self.use_tracemalloc:
+            self.__start_tracemalloc__(record, parent)
+        wall, cpu, child_cpu = time.perf_counter(), time.process_time(), children_cpu_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException as e:
+            # the trace of a failed or interrupted run shows where it stopped
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+            record['wall_time'] = time.perf_counter() - wall
+            record['cpu_time'] = time.process_time() - cpu
+            record['children_cpu_time'] = children_cpu_time() - child_cpu
+            record['rss_after'] = current_rss()
+            record['peak_rss'] = peak_rss()
+            if self.use_tracemalloc:
+                self.__stop_tracemalloc__(record, parent)
+            self.stack.pop()
+            if profiler:
+                record['profile'] = self.profile_path(record)
+                profiler.dump_stats(record['profile'])
+                if parent and parent[1]:
+                    parent[1].enable()
+
+    def __start_tracemalloc__(self, record, parent):
+        '''
+        The peak of tracemalloc is reset per stage; the peak of parent stage so far is kept in its record.
+        '''
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            record['_tracemalloc_started'] = True
+        current, peak = tracemalloc.get_traced_memory()
+        if parent:
+            parent[0]['_tracemalloc_peak'] = max(parent[0].get('_tracemalloc_peak', 0), peak)
+        record['_tracemalloc_start'] = current
+        tracemalloc.reset_peak()
+
+    def __stop_tracemalloc__(self, record, parent):
+        # the peak since the last reset includes this stage, thus also counts for the parent
+        peak = max(record.pop('_tracemalloc_peak', 0), tracemalloc.get_traced_memory()[1])
+        record['tracemalloc_peak'] = peak - record.pop('_tracemalloc_start')
+        if record.pop('_tracemalloc_started', False):
+            tracemalloc.stop()
+        elif parent:
+            parent[0]['_tracemalloc_peak'] = max(parent[0].get('_tracemalloc_peak', 0), peak)
+
+    def profile_path(self, record):
+        base = self.path[:-len('.json')] if self.path.endswith('.json') else self.path
+        return '%s_%02d_%s.prof' %(base, record['index'], record['stage'].replace('.', '_'))
+
+    def to_json(self):
+        return {'version': TRACE_VERSION,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'total_wall_time': time.perf_counter() - self.wall,
+                'peak_rss': peak_rss(), 'children_peak_rss': peak_rss('children'),
+                'profile': self.profile, 'tracemalloc': self.use_tracemalloc, 'stages': self.records}
+
+    def write(self):
+        with open(self.path, 'w') as O:
+            json.dump(self.to_json(), O, indent=2)
+
+
+def start_trace(paradict):
+    '''
+    Start the trace of a run if paradict['trace'] (path of JSON trace file) or paradict['profile'] is set.
+    Return the active StageTrace or None.
+    '''
+    global _trace
+    if paradict.get('trace') or paradict.get('profile'):
+        _trace = StageTrace(paradict.get('trace') or DEFAULT_TRACE_FILE, bool(paradict.get('profile')))
+    else:
+        _trace = None
+    return _trace
+
+def finish_trace():
+    '''
+    Write and close the active trace. Return its path, or None if not tracing.
+    '''
+    global _trace
+    if _trace is None:
+        return None
+    T, _trace = _trace, None
+    T.write()
+    return T.path
+
+
+@contextlib.contextmanager
+def active_trace(trace):
+    '''
+    Record stages in trace within the context, e.g. per job of the analysis server;
+    the trace active before is restored after.
+    '''
+    global _trace
+    previous, _trace = _trace, trace
+    try:
+        yield trace
+    finally:
+        _trace = previous
+
+
+@contextlib.contextmanager
+def stage(name):
+    '''
+    Record stage name in the active trace, yielding its record for item counts.
+    '''
+    if _trace is None:
+        yield {}
+    else:
+        with _trace.stage(name) as record:
+            yield record
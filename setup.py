@@ -43,7 +43,8 @@ setup(
   include_package_data=True,
   zip_safe=True,
   entry_points = {
-        'console_scripts': ['mummichog=mummichog.command_line:main'],
+        'console_scripts': ['mummichog=mummichog.command_line:main',
+                            'mummichog-batch=mummichog.batch:main'],
     },
 
   python_requires='>=3.4',
@@ -0,0 +1,116 @@
+'''
+Test of the CSR neighbourhood expansion in ModularAnalysis.find_modules,
+against nx.edges / nx.from_edgelist / nx.connected_components on the RECON3D network.
+Modules are compared as node and edge sets, as their order follows the expansion.
+
+    python -m pytest tests/test_find_modules.py
+'''
+
+import os
+import sys
+import json
+import random
+import subprocess
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from mummichog.models.get_models import get_metabolic_model
+from mummichog.algorithms import modularAnalysis
+from mummichog.algorithms.modularAnalysis import ModularAnalysis
+
+NUM_SEED_SETS = 40
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope='module')
+def model():
+    return get_metabolic_model(cache_dir=False)
+
+@pytest.fixture(scope='module')
+def analysis(model):
+    return make_analysis(model)
+
+
+def make_analysis(model):
+    '''
+    ModularAnalysis with only the network attributes used in module search, without user data
+    '''
+    MA = ModularAnalysis.__new__(ModularAnalysis)
+    MA.network = model.network
+    MA.node_ids, MA.indptr, MA.indices = model.get_csr_adjacency()
+    MA.node_index = dict(zip(MA.node_ids, range(len(MA.node_ids))))
+    return MA
+
+
+def as_sets(graph):
+    return frozenset(graph.nodes()), frozenset(frozenset(e) for e in graph.edges())
+
+def nx_search_steps(network, seeds):
+    '''
+    Module graphs of every search step, as found by networkx before the CSR fast path
+    '''
+    steps = []
+    for ii in range(modularAnalysis.SEARCH_STEPS):
+        edges = nx.edges(network, seeds)
+        if ii == 0:
+            edges = [x for x in edges if x[0] in seeds and x[1] in seeds]
+            new_network = nx.from_edgelist(edges)
+        else:
+            new_network = nx.from_edgelist(edges)
+            seeds = new_network.nodes()
+        steps.append([new_network.subgraph(c) for c in nx.connected_components(new_network)
+                      if 3 < len(c) < modularAnalysis.MODULE_SIZE_LIMIT])
+    return steps
+
+def csr_search_steps(MA, seeds):
+    '''
+    Module graphs of every search step, as in ModularAnalysis.find_modules
+    '''
+    steps = []
+    nodes = np.array([MA.node_index[x] for x in dict.fromkeys(seeds) if x in MA.node_index], dtype=np.int64)
+    for ii in range(modularAnalysis.SEARCH_STEPS):
+        edges = MA.__expand_edges__(nodes, seeds_only=(ii == 0))
+        new_nodes = MA.__edgelist_nodes__(edges)
+        if ii > 0:
+            nodes = new_nodes
+        steps.append(MA.__make_module_graphs__(new_nodes, edges))
+    return steps
+
+def random_seed_sets(network, num, seed=1):
+    '''
+    Seed cpds drawn around random nodes, so that seeds connect to each other, plus random ones
+    '''
+    rnd = random.Random(seed)
+    nodes = sorted(network.nodes())
+    for ii in range(num):
+        center = rnd.choice(nodes)
+        near = sorted(nx.single_source_shortest_path_length(network, center, cutoff=2))
+        yield rnd.sample(near, min(len(near), rnd.randint(5, 40))) + rnd.sample(nodes, rnd.randint(0, 20))
+
+
+def test_module_graphs_match_networkx(model, analysis):
+    num_modules = 0
+    for seeds in random_seed_sets(model.network, NUM_SEED_SETS):
+        for expected, found in zip(nx_search_steps(model.network, seeds), csr_search_steps(analysis, seeds)):
+            assert [as_sets(G) for G in found] == [as_sets(G) for G in expected]
+            num_modules += len(found)
+    assert num_modules > 0
+
+def test_module_graph_order_independent_of_hash_seed():
+    # node and edge order of module graphs, in fresh interpreters of different PYTHONHASHSEED
+    code = (
+        "import sys, json; sys.path[:0] = [%r, %r]\n"
+        "from test_find_modules import *\n"
+        "model = get_metabolic_model(cache_dir=False)\n"
+        "MA = make_analysis(model)\n"
+        "seeds = next(random_seed_sets(model.network, 1, seed=2))\n"
+        "print(json.dumps([(list(G.nodes()), list(G.edges())) "
+        "for step in csr_search_steps(MA, seeds) for G in step]))\n") %(TEST_DIR, os.path.dirname(TEST_DIR))
+    outputs = []
+    for hash_seed in ['0', '1']:
+        env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+        outputs.append(subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                                      capture_output=True, text=True).stdout)
+    assert outputs[0] == outputs[1] and json.loads(outputs[0])
@@ -0,0 +1,85 @@
+'''
+Regression test of Mmodule.compute_modularity (closed-form expected edges)
+against the pairwise loop over module nodes, on random subgraphs of a scale-free network
+of the size of RECON3D, so that degrees are skewed as in metabolic networks.
+
+    python -m pytest tests/test_modularity.py
+'''
+
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from mummichog.algorithms.modularAnalysis import Mmodule
+
+NUM_SUBGRAPHS = 300
+
+
+@pytest.fixture(scope='module')
+def network():
+    G = nx.powerlaw_cluster_graph(4000, 2, 0.2, seed=1)
+    return nx.relabel_nodes(G, {ii: 'C%05d' %ii for ii in G.nodes()})
+
+
+def pairwise_modularity(network, graph):
+    '''
+    Q as computed before, summing degree(ii) * degree(jj) over all pairs of module nodes, ii != jj
+    '''
+    m = network.number_of_edges()
+    Nodes = graph.nodes()
+    expected = 0
+    for ii in Nodes:
+        for jj in Nodes:
+            if ii != jj:
+                expected += network.degree(ii) * network.degree(jj)
+    expected /= (4.0 * m)
+    return (graph.number_of_edges() - expected) / m
+
+def pairwise_activity_score(network, M, TrioList):
+    '''
+    A as computed before, with Q by pairwise_modularity
+    '''
+    Ns = len(set([x[1] for x in TrioList if x[2] in M.graph.nodes()]))
+    Nm = float(M.graph.number_of_nodes())
+    if Nm > 0:
+        return np.sqrt(M.N_seeds/Nm) * pairwise_modularity(network, M.graph) * (Ns/Nm) * 100
+    else:
+        return 0
+
+def random_subgraphs(network, num, seed=1):
+    '''
+    Connected subgraphs of 4 to 60 nodes, grown breadth-first from random nodes
+    '''
+    rnd = random.Random(seed)
+    nodes = sorted(network.nodes())
+    for ii in range(num):
+        size = rnd.randint(4, 60)
+        source = rnd.choice(nodes)
+        selected, frontier = [source], [source]
+        while frontier and len(selected) < size:
+            x = frontier.pop(0)
+            for w in sorted(network.neighbors(x)):
+                if w not in selected and len(selected) < size:
+                    selected.append(w)
+                    frontier.append(w)
+        yield network.subgraph(selected), rnd
+
+def random_trios(graph, rnd):
+    '''
+    Trios of seed cpds drawn from graph nodes, some EmpCpds shared by several cpds
+    '''
+    nodes = sorted(graph.nodes())
+    seeds = rnd.sample(nodes, max(1, len(nodes) // 2))
+    return [('F%d' %ii, 'E%d' %(ii // 2), cpd) for ii, cpd in enumerate(seeds)]
+
+
+def test_modularity_matches_pairwise(network):
+    ref_degree = dict(network.degree())
+    for sub, rnd in random_subgraphs(network, NUM_SUBGRAPHS):
+        TrioList = random_trios(sub, rnd)
+        for M in (Mmodule(network, sub, TrioList), Mmodule(network, sub, TrioList, ref_degree)):
+            if M.graph.number_of_nodes():
+                assert M.Q == pairwise_modularity(network, M.graph)
+            assert M.A == pairwise_activity_score(network, M, TrioList)
@@ -0,0 +1,67 @@
+'''
+Test of PathwayAnalysis.get_adjust_p_by_sequential_permutations (adaptive mode),
+on a small synthetic mapping of features -> EmpCpds, with pathways of no possible significance.
+
+    python -m pytest tests/test_sequential_permutations.py
+'''
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from mummichog.annotate.meetModel import DataMeetModel
+from mummichog.algorithms.batchFisher import BatchFisherTest
+from mummichog.algorithms.pathwayAnalysis import PathwayAnalysis, metabolicPathway
+
+NUM_FEATURES = 200
+NUM_EMPCPDS = 100
+NUM_SIGNIFICANT = 20
+
+
+def make_analysis(engine):
+    '''
+    PathwayAnalysis with only the attributes used in permutations, without model or user data.
+    Feature ii maps to EmpCpd ii // 2.
+    '''
+    mixedNetwork = SimpleNamespace(
+        features = ['F%d' %ii for ii in range(NUM_FEATURES)],
+        significant_features = ['F%d' %ii for ii in range(NUM_SIGNIFICANT)],
+        feature_EmpCpd = np.arange(NUM_FEATURES) // 2,
+        EmpCpd_ids = ['E%d' %ii for ii in range(NUM_EMPCPDS)],
+    )
+    mixedNetwork.get_feature_EmpCpd_matrix = lambda: DataMeetModel.get_feature_EmpCpd_matrix(mixedNetwork)
+    PA = PathwayAnalysis.__new__(PathwayAnalysis)
+    PA.mixedNetwork = mixedNetwork
+    PA.paradict = {'permutation': 500, 'permutation_mode': 'adaptive', 'permutation_error': 0.2,
+                   'permutation_engine': engine, 'seed': 1}
+    PA.total_number_EmpiricalCompounds = NUM_EMPCPDS
+    PA.fisher = BatchFisherTest(NUM_EMPCPDS)
+    PA.permutation_entropy = 1
+    return PA
+
+def make_pathway(name, EmpiricalCompounds, p_EASE):
+    P = metabolicPathway()
+    P.name = name
+    P.EmpiricalCompounds = set(EmpiricalCompounds)
+    P.p_EASE = p_EASE
+    return P
+
+
+@pytest.mark.parametrize('engine', ['trio', 'sparse'])
+def test_no_overlap_pathways_are_not_significant(engine):
+    PA = make_analysis(engine)
+    pathways = [
+        make_pathway('empty', [], 1.0),
+        make_pathway('no overlap', ['E%d' %ii for ii in range(60, 80)], 1.0),
+        make_pathway('enriched', ['E%d' %ii for ii in range(10)], 1e-12),
+    ]
+    PA.get_adjust_p_by_sequential_permutations(pathways)
+    empty, no_overlap, enriched = pathways
+    h = int(np.ceil(1 / 0.2**2))
+    for P in (empty, no_overlap):
+        # every null p-value ties or beats p_EASE = 1; stop at the h-th permutation
+        assert P.num_permutations == h
+        assert P.adjusted_p == 1.0
+    assert enriched.num_permutations == 500
+    assert enriched.adjusted_p == 1 / 501.0